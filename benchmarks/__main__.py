@@ -0,0 +1,28 @@
+"""Offline benchmarks for the music hot paths against a fake Lavalink node.
+
+    python -m benchmarks [scenario ...] [--no-memory]
+"""
+import argparse
+import asyncio
+
+from .scenarios import SCENARIOS, report, run
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument(
+        'scenarios', nargs='*', metavar='scenario', help=f'scenarios to run, all by default: {", ".join(SCENARIOS)}'
+    )
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc, it slows every scenario down')
+    args = parser.parse_args()
+    if unknown := [name for name in args.scenarios if name not in SCENARIOS]:
+        parser.error(f'unknown scenarios: {", ".join(unknown)} (choose from {", ".join(SCENARIOS)})')
+
+    async def runner():
+        return [await run(name, memory=not args.no_memory) for name in args.scenarios or SCENARIOS]
+
+    print(report(asyncio.run(runner())))
+
+
+if __name__ == '__main__':
+    main()
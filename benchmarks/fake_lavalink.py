@@ -0,0 +1,187 @@
+from __future__ import annotations
+import asyncio
+import base64
+import collections
+import json
+from typing import Optional
+
+from aiohttp import web
+
+
+def encode_info(info: dict) -> str:
+    return base64.b64encode(json.dumps(info).encode()).decode()
+
+
+def decode_info(track: str) -> dict:
+    return json.loads(base64.b64decode(track))
+
+
+def make_track(title: str, length: int = 180_000) -> dict:
+    info = {
+        'identifier': title,
+        'isSeekable': True,
+        'author': 'bench',
+        'length': length,
+        'isStream': False,
+        'position': 0,
+        'title': title,
+        'uri': f'https://example.invalid/{title}',
+        'sourceName': 'youtube',
+    }
+    return {'track': encode_info(info), 'info': info}
+
+
+class FakeLavalink:
+    """Lavalink v3 stand-in: websocket player ops, /loadtracks, /decodetrack,
+    paged Spotify playlist endpoints under /spotify and an audio upstream
+    for the audio cache under /audio.
+
+    ``search_delay`` emulates the upstream search round trip, ``stats_interval``
+    controls how often stats are pushed to connected clients. Playing a
+    track that isn't a local file streams ``audio_size`` bytes from upstream,
+    which takes ``stream_delay`` seconds to start.
+    """
+
+    def __init__(
+        self,
+        *,
+        port: int = 0,
+        password: str = 'youshallnotpass',
+        search_delay: float = 0.02,
+        playlist_size: int = 10_000,
+        stats_interval: float = 1.0,
+        audio_size: int = 2**20,
+        stream_delay: float = 0.0,
+    ):
+        self.port = port
+        self.password = password
+        self.search_delay = search_delay
+        self.playlist_size = playlist_size
+        self.stats_interval = stats_interval
+        self.audio_size = audio_size
+        self.stream_delay = stream_delay
+        self.upstream_bytes = 0
+        self.plays: collections.Counter[str] = collections.Counter()
+        self.searches = 0
+        self.voice_updates = 0
+        self.spotify_pages = 0
+        self.players: dict[str, str] = {}
+        self.sockets: set[web.WebSocketResponse] = set()
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_get('/', self.websocket)
+        self.app.router.add_get('/loadtracks', self.load_tracks)
+        self.app.router.add_get('/decodetrack', self.decode_track)
+        self.app.router.add_get('/spotify/{type}s/{id}/tracks', self.spotify_tracks)
+        self.app.router.add_get('/audio', self.audio)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # type: ignore
+
+    async def close(self) -> None:
+        for ws in list(self.sockets):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def load_tracks(self, request: web.Request) -> web.Response:
+        identifier = request.query['identifier']
+        if identifier.startswith('/'):
+            # the local source, a file path
+            track = make_track(identifier)
+            track['info']['sourceName'] = 'local'
+            track['track'] = encode_info(track['info'])
+            return web.json_response({'loadType': 'TRACK_LOADED', 'playlistInfo': {}, 'tracks': [track]})
+        self.searches += 1
+        await asyncio.sleep(self.search_delay)
+        _, _, query = identifier.partition(':')
+        return web.json_response({
+            'loadType': 'SEARCH_RESULT',
+            'playlistInfo': {},
+            'tracks': [make_track(query or identifier)],
+        })
+
+    async def audio(self, request: web.Request) -> web.Response:
+        self.upstream_bytes += self.audio_size
+        return web.Response(body=bytes(self.audio_size), content_type='audio/webm')
+
+    async def decode_track(self, request: web.Request) -> web.Response:
+        return web.json_response(decode_info(request.query['track']))
+
+    async def spotify_tracks(self, request: web.Request) -> web.Response:
+        self.spotify_pages += 1
+        await asyncio.sleep(self.search_delay)
+        limit = int(request.query.get('limit', 100))
+        offset = int(request.query.get('offset', 0))
+        items = [
+            {'id': f'track{i}', 'name': f'Song {i}', 'artists': [{'name': 'Artist'}], 'duration_ms': 180_000}
+            for i in range(offset, min(offset + limit, self.playlist_size))
+        ]
+        if request.match_info['type'] == 'playlist':
+            items = [{'track': item} for item in items]
+        next_offset = offset + limit
+        next_url = None
+        if next_offset < self.playlist_size:
+            next_url = str(request.url.with_query(limit=limit, offset=next_offset))
+        return web.json_response({'items': items, 'next': next_url})
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        if request.headers.get('Authorization') != self.password:
+            raise web.HTTPUnauthorized()
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sockets.add(ws)
+        stats = asyncio.create_task(self._send_stats(ws))
+        try:
+            async for msg in ws:
+                await self.handle(ws, json.loads(msg.data))
+        finally:
+            stats.cancel()
+            self.sockets.discard(ws)
+        return ws
+
+    async def handle(self, ws: web.WebSocketResponse, data: dict) -> None:
+        op = data.get('op')
+        guild_id = data.get('guildId')
+        if op == 'play':
+            previous = self.players.get(guild_id)
+            if previous is not None and not data.get('noReplace'):
+                await self._event(ws, 'TrackEndEvent', guild_id, previous, reason='REPLACED')
+            self.players[guild_id] = data['track']
+            source = decode_info(data['track'])['sourceName']
+            self.plays[source] += 1
+            if source != 'local':
+                self.upstream_bytes += self.audio_size
+                await asyncio.sleep(self.stream_delay)
+            await self._event(ws, 'TrackStartEvent', guild_id, data['track'])
+        elif op == 'stop':
+            if (track := self.players.pop(guild_id, None)) is not None:
+                await self._event(ws, 'TrackEndEvent', guild_id, track, reason='STOPPED')
+        elif op == 'destroy':
+            self.players.pop(guild_id, None)
+        elif op == 'voiceUpdate':
+            self.voice_updates += 1
+
+    async def _event(self, ws: web.WebSocketResponse, type: str, guild_id: str, track: str, **extra) -> None:
+        await ws.send_json({'op': 'event', 'type': type, 'guildId': guild_id, 'track': track, **extra})
+
+    async def _send_stats(self, ws: web.WebSocketResponse) -> None:
+        while True:
+            await ws.send_json({
+                'op': 'stats',
+                'players': len(self.players),
+                'playingPlayers': len(self.players),
+                'uptime': 0,
+                'memory': {'free': 0, 'used': 0, 'allocated': 0, 'reservable': 0},
+                'cpu': {'cores': 1, 'systemLoad': 0.0, 'lavalinkLoad': 0.0},
+            })
+            await asyncio.sleep(self.stats_interval)
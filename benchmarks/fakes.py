@@ -0,0 +1,155 @@
+from __future__ import annotations
+import asyncio
+import itertools
+from typing import Any, Optional
+
+import discord
+
+from cogs.utils.metrics import Metrics
+
+_ids = itertools.count(1_000_000)
+
+
+class FakeMessage:
+    def __init__(self, channel: FakeChannel, **kwargs: Any):
+        self.id = next(_ids)
+        self.channel = channel
+        self.kwargs = kwargs
+
+    async def edit(self, **kwargs: Any) -> FakeMessage:
+        self.channel.edits += 1
+        self.kwargs.update(kwargs)
+        return self
+
+    async def delete(self) -> None:
+        self.channel.deletes += 1
+
+
+class FakeChannel:
+    def __init__(self, guild: FakeGuild):
+        self.id = next(_ids)
+        self.guild = guild
+        self.rtc_region = None
+        self.mention = f'<#{self.id}>'
+        self.sends = self.edits = self.deletes = 0
+
+    async def send(self, **kwargs: Any) -> FakeMessage:
+        self.sends += 1
+        return FakeMessage(self, **kwargs)
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = next(_ids)
+        self.voice_client: Optional[discord.VoiceProtocol] = None
+        self.text_channel = FakeChannel(self)
+        self.voice_channel = FakeChannel(self)
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        for channel in (self.text_channel, self.voice_channel):
+            if channel.id == channel_id:
+                return channel
+        return None
+
+    def get_member(self, user_id: int) -> Optional[FakeUser]:
+        return None
+
+    async def change_voice_state(self, **kwargs: Any) -> None:
+        pass
+
+
+class FakeUser:
+    def __init__(self):
+        self.id = next(_ids)
+        self.mention = f'<@{self.id}>'
+        self.voice = None
+
+
+class FakeResponse:
+    def __init__(self, interaction: FakeInteraction):
+        self.interaction = interaction
+        self._responded = False
+
+    def is_done(self) -> bool:
+        return self._responded
+
+    async def defer(self, **kwargs: Any) -> None:
+        self._responded = True
+
+    async def send_message(self, **kwargs: Any) -> None:
+        self._responded = True
+        self.interaction.message = FakeMessage(self.interaction.channel, **kwargs)
+
+    async def edit_message(self, **kwargs: Any) -> None:
+        self._responded = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction: FakeInteraction):
+        self.interaction = interaction
+
+    async def send(self, *, wait: bool = False, **kwargs: Any) -> Optional[FakeMessage]:
+        message = FakeMessage(self.interaction.channel, **kwargs)
+        return message if wait else None
+
+
+class FakeInteraction:
+    """Just enough of ``discord.Interaction`` for the music commands"""
+
+    def __init__(self, bot: FakeBot, guild: FakeGuild, user: Optional[FakeUser] = None):
+        self.client = bot
+        self.guild = guild
+        self.channel = guild.text_channel
+        self.user = user or FakeUser()
+        self.extras: dict[str, Any] = {}
+        self.message: Optional[FakeMessage] = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def original_message(self) -> Optional[FakeMessage]:
+        return self.message
+
+
+class FakeBot:
+    """Stands in for the gateway client: routes dispatched events to cog listeners"""
+
+    def __init__(self):
+        self.user = FakeUser()
+        self.owner_id = None
+        self.guilds: dict[int, FakeGuild] = {}
+        self.cogs: list[Any] = []
+        self.presence_updates = 0
+        self.metrics = Metrics()
+        self._waiters: dict[str, list[asyncio.Future]] = {}
+
+    @property
+    def voice_clients(self) -> list[discord.VoiceProtocol]:
+        return [guild.voice_client for guild in self.guilds.values() if guild.voice_client is not None]
+
+    def add_guild(self) -> FakeGuild:
+        guild = FakeGuild()
+        self.guilds[guild.id] = guild
+        return guild
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self.guilds.get(guild_id)
+
+    async def change_presence(self, **kwargs: Any) -> None:
+        self.presence_updates += 1
+
+    def dispatch(self, event: str, *args: Any, **kwargs: Any) -> None:
+        asyncio.create_task(self._dispatch(event, *args, **kwargs))
+
+    async def _dispatch(self, event: str, *args: Any, **kwargs: Any) -> None:
+        for cog in self.cogs:
+            for name, listener in cog.get_listeners():
+                if name == f'on_{event}':
+                    await listener(*args, **kwargs)
+        for waiter in self._waiters.pop(event, []):
+            if not waiter.done():
+                waiter.set_result(args)
+
+    def wait_for(self, event: str) -> asyncio.Future:
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(event, []).append(waiter)
+        return waiter
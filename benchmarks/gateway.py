@@ -0,0 +1,178 @@
+"""Gateway cost of a ``BOT_PROFILE``: guild caches and per-event CPU.
+
+Synthetic gateway payloads go through discord.py's own websocket message
+handling, parsers and dispatch. Like the real gateway, only the events
+the profile's intents subscribe to are delivered.
+"""
+from __future__ import annotations
+import asyncio
+import datetime
+import gc
+import itertools
+import json
+import random
+import time
+import tracemalloc
+from typing import Any, Iterator
+
+import discord
+from discord.gateway import DiscordWebSocket
+
+from bot import Bot
+
+_ids = itertools.count(10**17)
+JOINED_AT = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc).isoformat()
+
+# event -> intent it needs, with its share of the event stream
+EVENTS = {
+    'MESSAGE_CREATE': ('guild_messages', 0.6),
+    'TYPING_START': ('guild_typing', 0.2),
+    'MESSAGE_REACTION_ADD': ('guild_reactions', 0.1),
+    'VOICE_STATE_UPDATE': ('voice_states', 0.1),
+}
+
+
+def user(user_id: int) -> dict[str, Any]:
+    return {'id': str(user_id), 'username': f'user{user_id % 10000}', 'discriminator': '0001', 'avatar': None}
+
+
+def member(user_id: int) -> dict[str, Any]:
+    return {'user': user(user_id), 'roles': [], 'joined_at': JOINED_AT, 'deaf': False, 'mute': False}
+
+
+def voice_state(guild_id: int, channel_id: int, user_id: int) -> dict[str, Any]:
+    return {
+        'guild_id': str(guild_id), 'channel_id': str(channel_id), 'user_id': str(user_id),
+        'session_id': 'bench', 'deaf': False, 'mute': False, 'self_deaf': False, 'self_mute': False,
+        'self_video': False, 'suppress': False, 'request_to_speak_timestamp': None,
+    }
+
+
+class Guild:
+    def __init__(self, members: int, bot_id: int):
+        self.id = next(_ids)
+        self.text_id = next(_ids)
+        self.voice_id = next(_ids)
+        self.members = [next(_ids) for _ in range(members)] + [bot_id]
+        self.voice = self.members[:max(1, members // 20)]
+
+    def create(self) -> dict[str, Any]:
+        return {
+            'id': str(self.id), 'name': f'guild {self.id}', 'owner_id': str(self.members[0]),
+            'icon': None, 'splash': None, 'discovery_splash': None, 'banner': None, 'description': None,
+            'afk_timeout': 300, 'afk_channel_id': None, 'verification_level': 0,
+            'default_message_notifications': 0, 'explicit_content_filter': 0, 'mfa_level': 0,
+            'nsfw_level': 0, 'premium_tier': 0, 'system_channel_flags': 0, 'preferred_locale': 'en-US',
+            'features': [], 'emojis': [], 'stickers': [], 'threads': [], 'stage_instances': [],
+            'guild_scheduled_events': [], 'large': False, 'unavailable': False,
+            'member_count': len(self.members),
+            'roles': [{
+                'id': str(self.id), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+                'hoist': False, 'managed': False, 'mentionable': False,
+            }],
+            'channels': [
+                {'id': str(self.text_id), 'type': 0, 'name': 'general', 'position': 0, 'permission_overwrites': []},
+                {
+                    'id': str(self.voice_id), 'type': 2, 'name': 'music', 'position': 1,
+                    'permission_overwrites': [], 'bitrate': 64000, 'user_limit': 0,
+                },
+            ],
+            'members': [member(user_id) for user_id in self.members],
+            'voice_states': [voice_state(self.id, self.voice_id, user_id) for user_id in self.voice],
+        }
+
+    def event(self, name: str) -> dict[str, Any]:
+        author = random.choice(self.members)
+        base = {'guild_id': str(self.id), 'channel_id': str(self.text_id)}
+        if name == 'MESSAGE_CREATE':
+            return {
+                **base, 'id': str(next(_ids)), 'author': user(author), 'member': member(author),
+                'content': 'hello', 'timestamp': JOINED_AT, 'edited_timestamp': None, 'tts': False,
+                'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [],
+                'embeds': [], 'pinned': False, 'type': 0,
+            }
+        if name == 'TYPING_START':
+            return {**base, 'user_id': str(author), 'timestamp': int(time.time()), 'member': member(author)}
+        if name == 'MESSAGE_REACTION_ADD':
+            return {
+                **base, 'user_id': str(author), 'message_id': str(next(_ids)),
+                'emoji': {'id': None, 'name': '\N{THUMBS UP SIGN}'}, 'member': member(author),
+            }
+        return {**voice_state(self.id, self.voice_id, author), 'member': member(author)}
+
+
+def frame(seq: int, event: str, data: dict[str, Any]) -> str:
+    return json.dumps({'op': 0, 's': seq, 't': event, 'd': data})
+
+
+def websocket(bot: Bot) -> DiscordWebSocket:
+    # what DiscordWebSocket.from_client sets up, without a connection
+    ws = DiscordWebSocket(None, loop=asyncio.get_running_loop())  # type: ignore
+    ws._connection = bot._connection
+    ws._discord_parsers = bot._connection.parsers
+    ws._dispatch = bot.dispatch
+    ws.shard_id = 0
+    if bot._enable_debug_events:
+        ws.log_receive = ws.debug_log_receive  # type: ignore
+    return ws
+
+
+def event_stream(guilds: list[Guild], intents: discord.Intents, count: int) -> Iterator[tuple[str, dict]]:
+    names = list(EVENTS)
+    weights = [share for _, share in EVENTS.values()]
+    for name in random.choices(names, weights, k=count):
+        if getattr(intents, EVENTS[name][0]):
+            yield name, random.choice(guilds).event(name)
+
+
+async def drain() -> None:
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def measure(profile: str, *, guilds: int = 1000, members: int = 100, events: int = 50_000) -> dict[str, float]:
+    random.seed(0)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        gc.collect()
+        baseline = tracemalloc.get_traced_memory()[0]
+        bot = Bot(profile=profile)
+        await bot._async_setup_hook()
+        ws = websocket(bot)
+        bot_id = next(_ids)
+        fake_guilds = [Guild(members, bot_id) for _ in range(guilds)]
+        await ws.received_message(frame(1, 'READY', {
+            'v': 10, 'user': {**user(bot_id), 'bot': True}, 'guilds': [], 'session_id': 'bench',
+            'resume_gateway_url': 'wss://gateway.discord.gg', 'shard': [0, 1],
+            'application': {'id': str(bot_id), 'flags': 0},
+        }))
+        for seq, guild in enumerate(fake_guilds, 2):
+            await ws.received_message(frame(seq, 'GUILD_CREATE', guild.create()))
+        await drain()
+        gc.collect()
+        guild_memory = tracemalloc.get_traced_memory()[0] - baseline
+
+        stream = event_stream(fake_guilds, bot.intents, events)
+        frames = [frame(seq, name, data) for seq, (name, data) in enumerate(stream, len(fake_guilds) + 2)]
+        start = time.process_time()
+        for i, message in enumerate(frames):
+            await ws.received_message(message)
+            if i % 1000 == 0:
+                await drain()
+        await drain()
+        cpu = time.process_time() - start
+        gc.collect()
+        total_memory = tracemalloc.get_traced_memory()[0] - baseline
+        del bot, ws
+        return {
+            'guilds': guilds,
+            'delivered': len(frames),
+            'cpu': cpu,
+            'guild_memory': guild_memory,
+            'total_memory': total_memory,
+        }
+    finally:
+        if not tracing:
+            tracemalloc.stop()
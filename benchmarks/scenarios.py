@@ -0,0 +1,533 @@
+from __future__ import annotations
+import asyncio
+import collections
+import contextlib
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import wavelink
+from wavelink.ext import spotify
+
+from cogs import music
+from cogs.utils.audiocache import AudioCache
+from cogs.utils.fair import FairScheduler
+from cogs.utils.nodes import best_node
+from cogs.utils.paginator import PaginatorView
+from cogs.utils.queue import TrackQueue
+from cogs.utils.tracks import QueuedTrack
+
+from . import gateway
+from .fake_lavalink import FakeLavalink, make_track
+from .fakes import FakeBot, FakeInteraction, FakeUser
+
+PLAYLIST_URL = 'https://open.spotify.com/playlist/bench'
+
+
+@dataclass
+class Result:
+    name: str
+    ops: int
+    seconds: float
+    latencies: list[float] = field(default_factory=list)
+    peak: int = 0
+    notes: str = ''
+
+    @property
+    def throughput(self) -> float:
+        return self.ops / self.seconds if self.seconds else 0.0
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+@dataclass
+class Env:
+    server: FakeLavalink
+    bot: FakeBot
+    cog: music.MusicCog
+    node: wavelink.Node
+
+    def player(self, node: Optional[wavelink.Node] = None) -> music.Player:
+        guild = self.bot.add_guild()
+        player = music.Player(guild.text_channel, node=node or self.node)  # type: ignore
+        player(self.bot, guild.voice_channel)  # type: ignore
+        player._connected = True
+        guild.voice_client = player
+        self.cog.watch(player)
+        return player
+
+    def interaction(self, player: music.Player) -> FakeInteraction:
+        return FakeInteraction(self.bot, player.guild)  # type: ignore
+
+
+@contextlib.asynccontextmanager
+async def environment(**server_options) -> AsyncIterator[Env]:
+    server = FakeLavalink(**server_options)
+    await server.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['QUEUE_DB'] = os.path.join(tmp, 'queues.sqlite3')
+        os.environ['RESOLVED_DB'] = os.path.join(tmp, 'resolved.sqlite3')
+        bot = FakeBot()
+        client = spotify.SpotifyClient(client_id='bench', client_secret='bench')
+        client._bearer_token = 'bench'
+        client._expiry = float('inf')  # type: ignore
+        node = await wavelink.NodePool.create_node(
+            bot=bot,  # type: ignore
+            host='127.0.0.1',
+            port=server.port,
+            password=server.password,
+            spotify_client=client,
+        )
+        page_url, music.SPOTIFY_PAGE_URL = music.SPOTIFY_PAGE_URL, server.url + '/spotify/{type}s/{id}/tracks'
+        cog = music.MusicCog(bot)  # type: ignore
+        bot.cogs.append(cog)
+        try:
+            yield Env(server, bot, cog, node)
+        finally:
+            music.SPOTIFY_PAGE_URL = page_url
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+            cog.store.close()
+            cog.resolved.close()
+            if cog.audio_cache is not None:
+                await cog.audio_cache.close()
+            await client.session.close()
+            await node.cleanup()
+            await server.close()
+
+
+async def timed(coro: Awaitable) -> float:
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+async def playlist_enqueue(size: int = 10_000, search_delay: float = 0.02) -> Result:
+    """/play with a Spotify playlist of ``size`` tracks, streamed into the queue"""
+    async with environment(playlist_size=size, search_delay=search_delay) as env:
+        player = env.player()
+        first_start = env.bot.wait_for('wavelink_track_start')
+        start = time.perf_counter()
+        first: list[float] = []
+        first_start.add_done_callback(lambda _: first.append(time.perf_counter() - start))
+
+        await env.cog.play.callback(env.cog, env.interaction(player), PLAYLIST_URL)  # type: ignore
+        total = time.perf_counter() - start
+        await first_start
+        return Result(
+            'playlist_enqueue', size, total, [total],
+            notes=f'first track after {first[0] * 1000:.1f} ms, {env.server.spotify_pages} pages',
+        )
+
+
+async def repeat_playlist(size: int = 1_000, search_delay: float = 0.02) -> Result:
+    """A Spotify playlist played through, then queued again after a restart (the search cache is gone)"""
+    async with environment(playlist_size=size, search_delay=search_delay) as env:
+        passes = []
+        for _ in range(2):
+            env.cog.search_cache.clear()
+            player = env.player()
+            await env.cog.play.callback(env.cog, env.interaction(player), PLAYLIST_URL)  # type: ignore
+            partial = sum(track.is_partial for track in player.queue)
+            searches = env.server.searches
+            # resolve every entry like playback does
+            latencies = []
+            for track in list(player.queue):
+                if track.is_partial:
+                    latencies.append(await timed(env.cog.resolve_partial(track)))
+            await env.cog.resolved.flush()
+            passes.append((partial, env.server.searches - searches, latencies))
+            await player.stop()
+            player.queue.clear()
+
+        (_, first_searches, first), (partial, searches, _) = passes
+        # what resolving an entry at playback time costs now
+        lookups = [await timed(env.cog.resolved.get(f'track{i}')) for i in range(size)]
+        return Result(
+            'repeat_playlist', size, sum(lookups), lookups,
+            notes=(
+                f'first pass {first_searches} searches, {sum(first) / len(first) * 1000:.1f} ms each; '
+                f'repeat {partial} partial entries, {searches} searches'
+            ),
+        )
+
+
+async def concurrent_play(calls: int = 500, distinct: int = 50, search_delay: float = 0.02) -> Result:
+    """``calls`` concurrent /play calls in separate guilds over ``distinct`` queries"""
+    async with environment(search_delay=search_delay) as env:
+        players = [env.player() for _ in range(calls)]
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(
+            timed(env.cog.play.callback(env.cog, env.interaction(player), f'song {i % distinct}'))  # type: ignore
+            for i, player in enumerate(players)
+        ))
+        total = time.perf_counter() - start
+        return Result(
+            'concurrent_play', calls, total, list(latencies),
+            notes=f'{env.server.searches} searches, {env.cog.lookups.shared} shared lookups',
+        )
+
+
+async def node_failover(players: int = 20, search_delay: float = 0.02) -> Result:
+    """Players placed over two nodes, one node goes down, its players move to the other and keep playing"""
+    async with environment(search_delay=search_delay) as env:
+        backup = FakeLavalink(search_delay=search_delay)
+        await backup.start()
+        node = await wavelink.NodePool.create_node(
+            bot=env.bot,  # type: ignore
+            host='127.0.0.1',
+            port=backup.port,
+            password=backup.password,
+            identifier='backup',
+        )
+        try:
+            placed = []
+            for i in range(players):
+                player = env.player(best_node())
+                # a joined voice session, so moves have to send it to the new node
+                player._voice_state = {'sessionId': 'bench', 'event': {'endpoint': 'bench', 'token': 'bench'}}
+                started = env.bot.wait_for('wavelink_track_start')
+                await env.cog.play.callback(env.cog, env.interaction(player), f'before {i}')  # type: ignore
+                await started
+                placed.append(player)
+            moving = list(node.players)
+            assert moving and len(moving) < players, f'{len(moving)} of {players} players on the backup node'
+
+            env.cog.node_monitor.interval = 0.01
+            env.cog.node_monitor.start()
+            start = time.perf_counter()
+            await backup.close()
+            # done once every moved player plays on the other node
+            while node.players or any(str(player.guild.id) not in env.server.players for player in moving):
+                assert time.perf_counter() - start < 10, f'{len(node.players)} players left on the dead node'
+                await asyncio.sleep(0.005)
+            failover = time.perf_counter() - start
+            assert all(player.node is env.node for player in moving)
+            assert env.server.voice_updates == len(moving), 'moved players did not join the voice session'
+
+            # searches must avoid the dead node, and the moved players go on to their next track
+            latencies = []
+            searches = env.server.searches
+            for i, player in enumerate(moving):
+                await env.cog.play.callback(env.cog, env.interaction(player), f'after {i}')  # type: ignore
+                started = env.bot.wait_for('wavelink_track_start')
+                begin = time.perf_counter()
+                await player.stop()
+                await started
+                latencies.append(time.perf_counter() - begin)
+            assert all(player.source.title == f'after {i}' for i, player in enumerate(moving)), 'next tracks not playing'
+            assert env.server.searches - searches == len(moving), 'searches did not reach the live node'
+            return Result(
+                'node_failover', len(moving), sum(latencies), latencies,
+                notes=f'{len(moving)} of {players} players moved in {failover * 1000:.1f} ms, '
+                      f'{env.server.voice_updates} voice updates',
+            )
+        finally:
+            await node.cleanup()
+            await backup.close()
+
+
+async def transitions(count: int = 500, hold: float = 0.05, search_delay: float = 0.02) -> Result:
+    """Track end -> next track start over a queue of partial tracks"""
+    async with environment(search_delay=search_delay) as env:
+        player = env.player()
+        partials = [QueuedTrack.partial(f'transition {i}') for i in range(count + 1)]
+        env.cog.enqueue(player, partials, FakeUser())  # type: ignore
+        started = env.bot.wait_for('wavelink_track_start')
+        await env.cog.play_next(player)
+        await started
+
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(count):
+            # the time a track plays, lets the look-ahead window resolve the next ones
+            await asyncio.sleep(hold)
+            started = env.bot.wait_for('wavelink_track_start')
+            begin = time.perf_counter()
+            await player.stop()
+            await started
+            latencies.append(time.perf_counter() - begin)
+        total = time.perf_counter() - start
+        return Result(
+            'transitions', count, total, latencies,
+            notes=f'measured gap {player.average_gap * 1000:.2f} ms avg',  # type: ignore
+        )
+
+
+async def audio_cache(
+    plays: int = 2_000, catalogue: int = 500, budget: int = 50, audio_size: int = 256 * 1024, stream_delay: float = 0.05,
+) -> Result:
+    """Plays of a catalogue with Zipf popularity, streamed and then with an audio cache of ``budget`` tracks"""
+    rng = random.Random(0)
+    tracks = [
+        QueuedTrack.from_track(wavelink.YouTubeTrack(data['track'], data['info']))
+        for data in (make_track(f'popular {i}') for i in range(catalogue))
+    ]
+    order = rng.choices(tracks, [1 / (i + 1) for i in range(catalogue)], k=plays)
+
+    runs = {}
+    for cached in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            async with environment(audio_size=audio_size, stream_delay=stream_delay) as env:
+                if cached:
+                    env.cog.audio_cache = AudioCache(
+                        directory, env.server.url + '/audio?url={uri}', max_bytes=budget * audio_size, min_plays=2,
+                    )
+                player = env.player()
+                latencies = []
+                start = time.perf_counter()
+                for track in order:
+                    player.queue.put(track)
+                    started = env.bot.wait_for('wavelink_track_start')
+                    begin = time.perf_counter()
+                    await env.cog.play_next(player)
+                    await started
+                    latencies.append(time.perf_counter() - begin)
+                total = time.perf_counter() - start
+                runs[cached] = (env.server.upstream_bytes, env.server.plays['local'], latencies, total)
+
+    streamed, _, plain, _ = runs[False]
+    upstream, local, latencies, total = runs[True]
+    p50 = sorted(plain)[len(plain) // 2] * 1000
+    return Result(
+        'audio_cache', plays, total, latencies,
+        notes=(
+            f'{local / plays:.0%} plays from disk, upstream {upstream / 2**20:.0f} MiB '
+            f'against {streamed / 2**20:.0f} MiB, p50 start without cache {p50:.1f} ms'
+        ),
+    )
+
+
+async def queue_paging(size: int = 10_000, renders: int = 2_000) -> Result:
+    """Rendering queue pages of a ``size`` track queue, random pages then back and forth"""
+    async with environment() as env:
+        player = env.player()
+        player.queue.extend(
+            QueuedTrack.from_track(wavelink.YouTubeTrack(data['track'], data['info']))
+            for data in (make_track(f'paging {i}') for i in range(size))
+        )
+        source = music.QueueListSource(player)
+        view = PaginatorView(source, interaction=env.interaction(player))  # type: ignore
+        pages = source.get_max_pages()
+
+        latencies = []
+        start = time.perf_counter()
+        for i in range(renders):
+            page = random.randrange(pages) if i < renders // 2 else (i % 3)
+            view.current_page = page
+            latencies.append(await timed(view._render_page(page)))
+        total = time.perf_counter() - start
+        half = renders // 2
+        cold = sum(latencies[:half]) / half * 1000
+        warm = sum(latencies[half:]) / (renders - half) * 1000
+        return Result(
+            'queue_paging', renders, total, latencies,
+            notes=f'{pages} pages, random {cold:.3f} ms, revisits {warm:.3f} ms',
+        )
+
+
+async def queue_search(size: int = 20_000, lookups: int = 2_000, words: int = 2_000) -> Result:
+    """Title searches in a ``size`` track queue against a linear scan, with jumps in between"""
+    async with environment() as env:
+        player = env.player()
+        vocabulary = [f'word{i}' for i in range(words)]
+        player.queue.extend(
+            QueuedTrack.from_track(wavelink.YouTubeTrack(data['track'], data['info']))
+            for data in (make_track(' '.join(random.sample(vocabulary, 3))) for _ in range(size))
+        )
+        queries = [' '.join(random.sample(vocabulary, random.randint(1, 2))) for _ in range(lookups)]
+
+        latencies = []
+        matches = 0
+        start = time.perf_counter()
+        for i, query in enumerate(queries):
+            t = time.perf_counter()
+            found = player.queue.search(query, limit=25)
+            latencies.append(time.perf_counter() - t)
+            matches += len(found)
+            if found and i % 10 == 0:
+                player.queue.remove(found[-1][0])
+        total = time.perf_counter() - start
+
+        scans = queries[:100]
+        t = time.perf_counter()
+        for query in scans:
+            query_words = music.tokenize(query)
+            [
+                track for track in player.queue
+                if all(any(token.startswith(word) for token in music.tokenize(track.title)) for word in query_words)
+            ]
+        scan = (time.perf_counter() - t) / len(scans) * 1000
+        return Result(
+            'queue_search', lookups, total, latencies,
+            notes=f'{matches / lookups:.1f} matches/lookup, linear scan {scan:.1f} ms',
+        )
+
+
+def simulate_waits(
+    fair: Optional[FairScheduler], *, hours: float = 24.0, playlists: tuple[int, ...] = (500, 300),
+    listeners: int = 30, interval: float = 900.0, seed: int = 0,
+) -> tuple[list[float], list[float]]:
+    """Queue waits of single requests while big playlists are queued, in simulated seconds.
+
+    Playlists are queued every hour by requesters of their own, everyone
+    else requests 1-5 tracks every ``interval`` seconds on average. Returns
+    the waits for the first track of every request and the seconds spent
+    placing tracks.
+    """
+    rng = random.Random(seed)
+    queue: TrackQueue[QueuedTrack] = TrackQueue()
+    requests: list[tuple[float, int, int]] = [(hour * 3600.0, -hour - 1, size) for hour, size in enumerate(playlists)]
+    t = 0.0
+    while t < hours * 3600:
+        t += rng.expovariate(1 / interval)
+        requests.append((t, rng.randrange(listeners), rng.choice((1, 1, 1, 2, 5))))
+    requests.sort()
+
+    requested_at: dict[int, float] = {}
+    waits, placing = [], []
+    now, pending = 0.0, collections.deque(requests)
+    while pending or queue:
+        while pending and (pending[0][0] <= now or not queue):
+            at, requester_id, size = pending.popleft()
+            now = max(now, at)
+            tracks = [
+                QueuedTrack(id='sim', title='sim', length=rng.uniform(120, 360), requester_id=requester_id)
+                for _ in range(size)
+            ]
+            start = time.perf_counter()
+            if fair is not None:
+                fair.enqueue(queue, tracks)
+            else:
+                queue.extend(tracks)
+            placing.append(time.perf_counter() - start)
+            if requester_id >= 0:
+                requested_at[id(tracks[0])] = at
+        track = queue.get()
+        if fair is not None:
+            fair.served(track)
+        if (at := requested_at.pop(id(track), None)) is not None:
+            waits.append(now - at)
+        now += track.length
+    return waits, placing
+
+
+async def fair_queue(**options) -> Result:
+    """Simulated waits of single requests behind big playlists, first come first served and fair"""
+    notes, placing = [], []
+    for mode, fair in (
+        ('fifo', None),
+        ('tracks', FairScheduler()),
+        ('length', FairScheduler(by_length=True)),
+    ):
+        waits, placing = simulate_waits(fair, **options)
+        waits.sort()
+        minutes = [waits[min(len(waits) - 1, int(q * len(waits)))] / 60 for q in (0.5, 0.99)] + [waits[-1] / 60]
+        notes.append(f'{mode} p50/p99/max {"/".join(f"{m:.0f}" for m in minutes)} min')
+    # latencies of placing tracks in the fair (by length) queue
+    return Result('fair_queue', len(placing), sum(placing), placing, notes=', '.join(notes))
+
+
+async def queue_memory(size: int = 10_000) -> Result:
+    """Bytes per queued track, full wavelink tracks against compact queue entries"""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        # as parsed from lavalink responses, so every track owns its strings
+        payloads = [json.dumps(make_track(f'memory {i}')) for i in range(size)]
+        requester = FakeUser()
+        sizes = {}
+
+        def parse(raw: str) -> wavelink.YouTubeTrack:
+            data = json.loads(raw)
+            return wavelink.YouTubeTrack(data['track'], data['info'])
+
+        start = time.perf_counter()
+        for kind in ('full', 'compact'):
+            before = tracemalloc.get_traced_memory()[0]
+            if kind == 'full':
+                tracks = [parse(data) for data in payloads]
+                for track in tracks:
+                    track.requester = requester  # type: ignore
+            else:
+                tracks = [QueuedTrack.from_track(parse(data), requester.id) for data in payloads]
+            sizes[kind] = (tracemalloc.get_traced_memory()[0] - before) / size
+            del tracks
+        total = time.perf_counter() - start
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    return Result(
+        'queue_memory', size, total,
+        notes=f'full {sizes["full"]:.0f} B/track, compact {sizes["compact"]:.0f} B/track',
+    )
+
+
+async def gateway_profile(profile: str, **options) -> Result:
+    """Guild create and event handling under a ``BOT_PROFILE``, see gateway.py"""
+    stats = await gateway.measure(profile, **options)
+    return Result(
+        f'gateway_{profile}', stats['delivered'], stats['cpu'],
+        notes=f'{stats["guild_memory"] / stats["guilds"] / 1024:.1f} KiB/guild, '
+              f'{stats["total_memory"] / 2**20:.1f} MiB after events, '
+              f'{stats["cpu"] / max(stats["delivered"], 1) * 1e6:.1f} us cpu/event',
+    )
+
+
+async def gateway_full(**options) -> Result:
+    return await gateway_profile('full', **options)
+
+
+async def gateway_lean(**options) -> Result:
+    return await gateway_profile('lean', **options)
+
+
+SCENARIOS: dict[str, Callable[..., Awaitable[Result]]] = {
+    'playlist_enqueue': playlist_enqueue,
+    'concurrent_play': concurrent_play,
+    'repeat_playlist': repeat_playlist,
+    'transitions': transitions,
+    'node_failover': node_failover,
+    'queue_paging': queue_paging,
+    'queue_search': queue_search,
+    'fair_queue': fair_queue,
+    'queue_memory': queue_memory,
+    'audio_cache': audio_cache,
+    'gateway_full': gateway_full,
+    'gateway_lean': gateway_lean,
+}
+
+
+async def run(name: str, *, memory: bool = True, **options) -> Result:
+    if memory:
+        tracemalloc.start()
+    try:
+        result = await SCENARIOS[name](**options)
+        if memory:
+            result.peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return result
+
+
+def report(results: list[Result]) -> str:
+    lines = [f'{"scenario":<18} {"ops":>7} {"ops/s":>10} {"p50 ms":>9} {"p99 ms":>9} {"peak MiB":>9}  notes']
+    for r in results:
+        lines.append(
+            f'{r.name:<18} {r.ops:>7} {r.throughput:>10.1f} {r.percentile(0.5) * 1000:>9.2f} '
+            f'{r.percentile(0.99) * 1000:>9.2f} {r.peak / 2**20:>9.1f}  {r.notes}'
+        )
+    return '\n'.join(lines)
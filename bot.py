@@ -1,21 +1,202 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Optional
+
+import discord
+from discord import app_commands
 from discord.ext import commands
-import jishaku
+from wavelink.ext import spotify
+
+from cogs.utils.funcs import getenv
+from cogs.utils.metrics import Metrics, RateLimitHandler
+from cogs.utils.nodes import connect_nodes, load_node_configs
+
+log = logging.getLogger(__name__)
 
 BULK = False
 
+EXTENSIONS = ('cogs.music', 'cogs.debug')
+
+
+async def load_jishaku(bot: commands.Bot) -> None:
+    import jishaku
+    await bot.add_cog(jishaku.Jishaku(bot=bot))
+
+# prefix command name -> loader, imported and added on first use
+LAZY_COMMANDS = {
+    'jsk': load_jishaku,
+    'jishaku': load_jishaku,
+}
+
+
+def profile_options(profile: str) -> dict[str, Any]:
+    """Client options for a ``BOT_PROFILE``.
+
+    ``full``, the default, is the default intents and caches with debug events.
+    ``lean`` subscribes only to what the slash commands need: guilds, voice
+    states and interactions, plus direct messages for the owner's prefix
+    commands. Members are cached while they are in voice, messages are not
+    cached and raw socket events are not dispatched. Without guild messages,
+    mention prefix commands only work in DMs and the paginator's page number
+    prompt gets no reply.
+    """
+    if profile == 'full':
+        return {'intents': discord.Intents.default(), 'enable_debug_events': True}
+
+    intents = discord.Intents.none()
+    intents.guilds = intents.voice_states = intents.dm_messages = True
+    return {
+        'intents': intents,
+        'member_cache_flags': discord.MemberCacheFlags.from_intents(intents),
+        'max_messages': None,
+        'chunk_guilds_at_startup': False,
+        'enable_debug_events': False,
+    }
+
+
+class CommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras['started'] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError) -> None:
+        self.client.observe_command(interaction, 'error')  # type: ignore
+        await super().on_error(interaction, error)
+
+
 # 824997091075555419
-class Bot(commands.Bot):
-    def __init__(self):
+class Bot(commands.AutoShardedBot):
+    def __init__(
+        self,
+        *,
+        started: Optional[float] = None,
+        shard_ids: Optional[list[int]] = None,
+        shard_count: Optional[int] = None,
+        coordinator: Optional[Connection] = None,
+        profile: Optional[str] = None,
+    ):
         super().__init__(
             commands.when_mentioned,
-            enable_debug_events=True,
+            tree_cls=CommandTree,
+            **profile_options(profile or getenv('BOT_PROFILE', 'full')),
+            shard_ids=shard_ids,
+            shard_count=shard_count or getenv('SHARD_COUNT', None, int),
+        )
+        # set when running as a cluster worker, stats are reported through it
+        self.coordinator = coordinator
+        self.started = started or time.perf_counter()
+        # phase -> seconds since ``started`` it finished at
+        self.startup: dict[str, float] = {}
+        self.nodes_ready: Optional[asyncio.Task] = None
+        self.reporter: Optional[asyncio.Task] = None
+        self.metrics = Metrics()
+        self.command_latency = self.metrics.histogram(
+            'app_command_seconds', 'Application command latency', ('command', 'status')
         )
+        self.startup_timings = self.metrics.gauge('startup_seconds', 'Time from process start to a startup phase', ('phase',))
+        logging.getLogger('discord.http').addHandler(RateLimitHandler(self.metrics))
+        self.mark_startup('init')
+
+    def mark_startup(self, phase: str) -> None:
+        if phase not in self.startup:
+            self.startup[phase] = time.perf_counter() - self.started
+            self.startup_timings.set(self.startup[phase], phase=phase)
+
+    def owns_guild(self, guild_id: int) -> bool:
+        if self.shard_ids is None or self.shard_count is None:
+            return True
+        return (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    def stats(self) -> dict[str, Any]:
+        players = [vc for vc in self.voice_clients if hasattr(vc, 'queue')]
+        return {
+            'pid': os.getpid(),
+            'ready': self.is_ready(),
+            'guilds': len(self.guilds),
+            'players': len(players),
+            'queued': sum(vc.queue.count for vc in players),  # type: ignore
+            'latency': self.latency if math.isfinite(self.latency) else None,
+            'shard_latencies': dict(self.latencies),
+        }
+
+    async def report_stats(self) -> None:
+        interval = getenv('CLUSTER_REPORT_INTERVAL', 5.0, float)
+        while not self.is_closed():
+            try:
+                self.coordinator.send(self.stats())  # type: ignore
+            except (BrokenPipeError, OSError):
+                log.warning('Lost the coordinator, shutting down')
+                await self.close()
+                return
+            await asyncio.sleep(interval)
+
+    def observe_command(self, interaction: discord.Interaction, status: str) -> None:
+        started = interaction.extras.get('started')
+        if started is not None and interaction.command is not None:
+            self.command_latency.observe(
+                time.perf_counter() - started, command=interaction.command.qualified_name, status=status
+            )
+            self.mark_startup('first_command')
+
+    async def connect_nodes(self) -> None:
+        # never raises, commands awaiting it would all fail with the same error
+        try:
+            await connect_nodes(
+                self,
+                load_node_configs(),
+                spotify_client=spotify.SpotifyClient(
+                    client_id=os.environ.get('SPOTIFY_CLIENT_ID'),
+                    client_secret=os.environ.get('SPOTIFY_CLIENT_SECRET')
+                )
+            )
+        except Exception:
+            log.exception('Could not set up the Lavalink nodes')
+            return
+        self.mark_startup('nodes')
 
     async def setup_hook(self) -> None:
-        print('loading cogs')
-        await self.load_extension("cogs.music")
-        await self.add_cog(jishaku.Jishaku(bot=self))
-        print('end')
+        self.mark_startup('login')
+        # runs once per process, alongside the gateway connect that follows this hook
+        self.nodes_ready = asyncio.create_task(self.connect_nodes())
+        if self.coordinator is not None:
+            self.reporter = asyncio.create_task(self.report_stats())
+        if port := getenv('METRICS_PORT', 9100, int):
+            try:
+                await self.metrics.start(getenv('METRICS_HOST', '127.0.0.1'), port)
+            except OSError:
+                # the port is taken, the bot runs without the endpoint
+                log.exception('Could not serve metrics on port %s', port)
+                await self.metrics.close()
+        await asyncio.gather(*map(self.load_extension, EXTENSIONS))
+        self.mark_startup('extensions')
+
+    async def close(self) -> None:
+        # report_stats closes the bot itself when the coordinator is gone
+        if self.reporter is not None and self.reporter is not asyncio.current_task():
+            self.reporter.cancel()
+        await self.metrics.close()
+        await super().close()
     
     async def on_ready(self):
-        print(f'ready {self.user}')
+        if 'ready' not in self.startup:
+            self.mark_startup('ready')
+            log.info(
+                'Ready as %s, startup: %s', self.user,
+                ', '.join(f'{phase} {at:.2f}s' for phase, at in self.startup.items()),
+            )
+
+    async def process_commands(self, message: discord.Message) -> None:
+        if message.author.bot:
+            return
+        ctx = await self.get_context(message)
+        if ctx.command is None and (loader := LAZY_COMMANDS.get(ctx.invoked_with)) is not None:  # type: ignore
+            await loader(self)
+            ctx = await self.get_context(message)
+        await self.invoke(ctx)
+
+    async def on_app_command_completion(self, interaction: discord.Interaction, command) -> None:
+        self.observe_command(interaction, 'ok')
@@ -0,0 +1,231 @@
+from __future__ import annotations
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection
+from typing import Any, Optional
+
+import aiohttp
+from aiohttp import web
+
+from cogs.utils.funcs import getenv
+
+log = logging.getLogger('cluster')
+
+GATEWAY_URL = 'https://discord.com/api/v10/gateway/bot'
+
+
+def shard_ranges(shard_count: int, workers: int) -> list[list[int]]:
+    """Split ``shard_count`` shards into ``workers`` contiguous ranges"""
+    size, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for i in range(workers):
+        end = start + size + (i < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+    return [shards for shards in ranges if shards]
+
+
+async def recommended_shards(token: str) -> int:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_URL, headers={'Authorization': f'Bot {token}'}) as resp:
+            resp.raise_for_status()
+            return (await resp.json())['shards']
+
+
+def run_worker(index: int, shard_ids: list[int], shard_count: int, conn: Connection, token: str) -> None:
+    started = time.perf_counter()
+    # every worker serves its own metrics, on consecutive ports
+    if port := getenv('METRICS_PORT', 9100, int):
+        os.environ['METRICS_PORT'] = str(port + index)
+
+    from bot import Bot
+    Bot(started=started, shard_ids=shard_ids, shard_count=shard_count, coordinator=conn).run(token=token, root_logger=True)
+
+
+@dataclass
+class Worker:
+    index: int
+    shard_ids: list[int]
+    process: Optional[multiprocessing.process.BaseProcess] = None
+    conn: Optional[Connection] = None
+    stats: dict[str, Any] = field(default_factory=dict)
+    started_at: float = 0.0
+    seen_at: float = 0.0
+    restarts: int = 0
+    restart: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def restarting(self) -> bool:
+        return self.restart is not None and not self.restart.done()
+
+
+class Coordinator:
+    """Runs the bot as ``workers`` processes, each owning a contiguous shard range.
+
+    Workers report their stats over a pipe every few seconds. A worker
+    that exits or stops reporting for ``timeout`` seconds is restarted,
+    its guilds' players are restored from the queue store by the new
+    process. Aggregated stats are served as json on ``/stats``.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        *,
+        workers: int,
+        shard_count: Optional[int] = None,
+        timeout: float = 60.0,
+        startup_timeout: float = 300.0,
+        port: int = 0,
+    ):
+        self.token = token
+        self.worker_count = workers
+        self.shard_count = shard_count
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.port = port
+        self.workers: list[Worker] = []
+        self.context = multiprocessing.get_context('spawn')
+
+    def start_worker(self, worker: Worker) -> None:
+        loop = asyncio.get_running_loop()
+        receiver, sender = self.context.Pipe(duplex=False)
+        worker.process = self.context.Process(
+            target=run_worker,
+            args=(worker.index, worker.shard_ids, self.shard_count, sender, self.token),
+            name=f'worker-{worker.index}',
+        )
+        worker.process.start()
+        sender.close()
+        worker.conn = receiver
+        worker.stats = {}
+        worker.started_at = time.monotonic()
+        worker.seen_at = 0.0
+        loop.add_reader(receiver.fileno(), self._receive, worker)
+        log.info('Started worker %s (pid %s) with shards %s', worker.index, worker.process.pid, worker.shard_ids)
+
+    def stop_worker(self, worker: Worker) -> None:
+        if worker.conn is not None:
+            asyncio.get_running_loop().remove_reader(worker.conn.fileno())
+            worker.conn.close()
+            worker.conn = None
+        if worker.process is not None:
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.process.join(10)
+            if worker.process.is_alive():
+                worker.process.kill()
+            worker.process = None
+        worker.stats = {}
+
+    def _receive(self, worker: Worker) -> None:
+        conn = worker.conn
+        try:
+            while conn is not None and conn.poll():
+                worker.stats = conn.recv()
+                worker.seen_at = time.monotonic()
+        except (EOFError, OSError):
+            # the process is gone, the health check restarts it
+            asyncio.get_running_loop().remove_reader(conn.fileno())  # type: ignore
+
+    def unhealthy(self, worker: Worker) -> Optional[str]:
+        now = time.monotonic()
+        if not worker.alive:
+            return 'exited'
+        if worker.seen_at and now - worker.seen_at > self.timeout:
+            return f'no report for {now - worker.seen_at:.0f}s'
+        if not worker.seen_at and now - worker.started_at > self.startup_timeout:
+            return 'did not start'
+        return None
+
+    async def restart_worker(self, worker: Worker, reason: str) -> None:
+        log.warning('Restarting worker %s: %s', worker.index, reason)
+        self.stop_worker(worker)
+        worker.restarts += 1
+        # back off a worker that keeps failing
+        await asyncio.sleep(min(2 ** worker.restarts, 60))
+        self.start_worker(worker)
+
+    async def health_check(self, interval: float = 5.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            for worker in self.workers:
+                if not worker.restarting and (reason := self.unhealthy(worker)):
+                    worker.restart = asyncio.create_task(self.restart_worker(worker, reason))
+
+    def stats(self) -> dict[str, Any]:
+        workers = [
+            {
+                'index': worker.index,
+                'shards': worker.shard_ids,
+                'alive': worker.alive,
+                'restarts': worker.restarts,
+                **worker.stats,
+            }
+            for worker in self.workers
+        ]
+        reported = [worker.stats for worker in self.workers if worker.stats]
+        return {
+            'shard_count': self.shard_count,
+            'guilds': sum(stats['guilds'] for stats in reported),
+            'players': sum(stats['players'] for stats in reported),
+            'queued': sum(stats['queued'] for stats in reported),
+            'latency': max((stats['latency'] for stats in reported if stats['latency'] is not None), default=None),
+            'workers': workers,
+        }
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def log_stats(self, interval: float = 60.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.stats()
+            log.info(
+                '%s guilds, %s players, %s queued tracks, %s/%s workers alive',
+                stats['guilds'], stats['players'], stats['queued'],
+                sum(worker['alive'] for worker in stats['workers']), len(self.workers),
+            )
+
+    async def start(self) -> None:
+        if self.shard_count is None:
+            self.shard_count = max(await recommended_shards(self.token), self.worker_count)
+        self.workers = [
+            Worker(index, shard_ids)
+            for index, shard_ids in enumerate(shard_ranges(self.shard_count, self.worker_count))
+        ]
+        log.info('Running %s shards on %s workers', self.shard_count, len(self.workers))
+        for worker in self.workers:
+            self.start_worker(worker)
+
+        runner = None
+        if self.port:
+            app = web.Application()
+            app.router.add_get('/stats', self._handle_stats)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, '127.0.0.1', self.port).start()
+        try:
+            await asyncio.gather(self.health_check(), self.log_stats())
+        finally:
+            for worker in self.workers:
+                if worker.restart is not None:
+                    worker.restart.cancel()
+                self.stop_worker(worker)
+            if runner is not None:
+                await runner.cleanup()
+
+    def run(self) -> None:
+        logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)-8s] %(name)s: %(message)s')
+        try:
+            asyncio.run(self.start())
+        except KeyboardInterrupt:
+            pass
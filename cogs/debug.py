@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import io
+import time
+from typing import TYPE_CHECKING
+
+import discord
+from discord.ext import commands
+
+from .utils.funcs import getenv
+from .utils.loopmon import LoopLagMonitor, SamplingProfiler, SlowCallbackDetector
+
+if TYPE_CHECKING:
+    from ..bot import Bot
+
+
+class DebugCog(commands.Cog):
+    """Owner-only event loop diagnostics.
+
+    The lag monitor and slow callback detector are off unless ``LOOP_MONITOR=1``
+    or they are turned on with ``debug monitor on``.
+    """
+
+    def __init__(self, bot: Bot) -> None:
+        self.bot = bot
+        self.lag = LoopLagMonitor(
+            interval=getenv('LOOP_LAG_INTERVAL', 0.25, float),
+            threshold=getenv('LOOP_LAG_THRESHOLD', 0.1, float),
+            histogram=bot.metrics.histogram('loop_lag_seconds', 'How late the event loop runs a sleeping task'),
+        )
+        self.detector = SlowCallbackDetector(threshold=getenv('SLOW_CALLBACK_THRESHOLD', 0.1, float))
+        self.profiler = SamplingProfiler(interval=getenv('PROFILE_INTERVAL', 0.005, float))
+
+    async def cog_load(self) -> None:
+        if getenv('LOOP_MONITOR', 0, int):
+            self.start_monitor()
+
+    async def cog_unload(self) -> None:
+        self.stop_monitor()
+
+    async def cog_check(self, ctx: commands.Context) -> bool:
+        return await self.bot.is_owner(ctx.author)
+
+    def start_monitor(self) -> None:
+        self.lag.start()
+        self.detector.start()
+
+    def stop_monitor(self) -> None:
+        self.lag.stop()
+        self.detector.stop()
+
+    @commands.group(invoke_without_command=True)
+    async def debug(self, ctx: commands.Context) -> None:
+        """Event loop lag and slow callback summary"""
+        state = 'on' if self.detector.enabled else 'off'
+        await ctx.send(
+            f'monitor: {state}\n'
+            f'loop lag p50 {self.lag.percentile(0.5) * 1000:.1f} ms, '
+            f'p99 {self.lag.percentile(0.99) * 1000:.1f} ms, '
+            f'worst {self.lag.worst * 1000:.1f} ms\n'
+            f'slow callbacks: {len(self.detector.slow)}'
+        )
+
+    @debug.command()
+    async def monitor(self, ctx: commands.Context, enabled: bool) -> None:
+        """Turn the lag monitor and slow callback detector on or off"""
+        if enabled:
+            self.start_monitor()
+        else:
+            self.stop_monitor()
+        await ctx.message.add_reaction('\N{WHITE HEAVY CHECK MARK}')
+
+    @debug.command()
+    async def slow(self, ctx: commands.Context, count: int = 5) -> None:
+        """The most recent slow callbacks with their stacks"""
+        if not self.detector.slow:
+            return await ctx.send('No slow callbacks recorded')
+
+        report = io.StringIO()
+        for callback in reversed(self.detector.slow):
+            at = time.strftime('%H:%M:%S', time.localtime(callback.at))
+            report.write(f'[{at}] {callback.name} took {callback.duration * 1000:.1f} ms\n')
+            report.write(''.join(callback.stack) + '\n')
+        summary = '\n'.join(
+            f'{c.duration * 1000:>8.1f} ms  {c.name}' for c in list(reversed(self.detector.slow))[:count]
+        )
+        await ctx.send(
+            f'```\n{summary[:1900]}\n```',
+            file=discord.File(io.BytesIO(report.getvalue().encode()), filename='slow_callbacks.txt'),
+        )
+
+    @debug.command()
+    async def profile(self, ctx: commands.Context, seconds: float = 10.0) -> None:
+        """Sample the event loop thread for ``seconds`` and upload collapsed stacks"""
+        if self.profiler.running:
+            return await ctx.send('A profile is already running')
+
+        async with ctx.typing():
+            stacks = await self.profiler.profile(min(seconds, 120.0))
+        filename = f'profile-{time.strftime("%Y%m%d-%H%M%S")}.folded'
+        await ctx.send(
+            f'{sum(stacks.values())} samples, open with flamegraph.pl or speedscope',
+            file=discord.File(io.BytesIO(self.profiler.dump(stacks).encode()), filename=filename),
+        )
+
+
+async def setup(bot: Bot):
+    await bot.add_cog(DebugCog(bot))
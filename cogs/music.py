@@ -1,40 +1,101 @@
 from __future__ import annotations
 
-import os
-from typing import TYPE_CHECKING, Optional, Union
+import asyncio
+import collections
+import contextlib
+import logging
+import time
+from typing import TYPE_CHECKING, AsyncIterator, Optional, Union
 
 import wavelink
 from wavelink.ext import spotify
+from wavelink.utils import MISSING
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 
-from .utils.funcs import send
+from .utils.audiocache import AudioCache
+from .utils.cache import SharedIterator, SingleFlight, TTLCache, normalize_query
+from .utils.fair import FairScheduler
+from .utils.funcs import getenv, send
+from .utils.metrics import Histogram
+from .utils.nowplaying import ChannelBuckets, NowPlaying
+from .utils.nodes import NodeMonitor, best_node
+from .utils.presence import PresenceScheduler
 from .utils.paginator import PaginatorView, BaseListSource
+from .utils.queue import TrackQueue, tokenize
+from .utils.resolved import ResolvedStore
+from .utils.storage import QueueStore
+from .utils.suggest import PrefixIndex, RateLimiter
+from .utils.tracks import QueuedTrack
 
 if TYPE_CHECKING:
     from ..bot import Bot
 
-    class Track(wavelink.PartialTrack):
-        requester: discord.Member
+log = logging.getLogger(__name__)
+
+PREFETCH_WINDOW = getenv('PREFETCH_WINDOW', 3, int)
+PREFETCH_CONCURRENCY = getenv('PREFETCH_CONCURRENCY', 4, int)
+PREFETCH_RETRIES = getenv('PREFETCH_RETRIES', 3, int)
+
+JOURNAL_FLUSH_INTERVAL = getenv('JOURNAL_FLUSH_INTERVAL', 1.0, float)
+# how often the position of playing tracks is journaled
+POSITION_INTERVAL = getenv('POSITION_INTERVAL', 60.0, float)
+SNAPSHOT_JOURNAL_SIZE = getenv('SNAPSHOT_JOURNAL_SIZE', 1000, int)
+
+REAP_INTERVAL = getenv('REAP_INTERVAL', 15.0, float)
+# reason -> seconds a player may stay that way before it is disconnected, 0 never
+REAP_AFTER = {
+    'empty': getenv('REAP_EMPTY_AFTER', 120.0, float),
+    'idle': getenv('REAP_IDLE_AFTER', 300.0, float),
+    'paused': getenv('REAP_PAUSED_AFTER', 1800.0, float),
+}
+# keep the queue of a reaped player, the next connect in its guild picks it up
+REAP_PARK = getenv('REAP_PARK', 1, int)
+
+# '' queues first come first served, 'tracks' or 'length' share the queue between requesters
+FAIR_QUEUE = getenv('FAIR_QUEUE', '')
+# how many turns the dj gets for everyone else's one
+FAIR_DJ_WEIGHT = getenv('FAIR_DJ_WEIGHT', 1.0, float)
+
+# discord drops autocomplete responses after 3 seconds
+AUTOCOMPLETE_TIMEOUT = getenv('AUTOCOMPLETE_TIMEOUT', 2.0, float)
+# splits the position from the title in queued track choices, nobody types it
+POSITION_SEPARATOR = '\u200b'
+
+class NoMatches(Exception):
+    """A partial track's search found nothing, retrying won't help"""
+
+
+channel_buckets = ChannelBuckets(getenv('NOW_PLAYING_INTERVAL', 1.0, float))
 
 def humanize_seconds(s: int):
     hours, minutes = divmod(abs(s), 3600)
     minutes, seconds = divmod(minutes, 60)
     times = []
-    for i, time in enumerate((hours, minutes, seconds)):
+    for i, part in enumerate((hours, minutes, seconds)):
         if i == hours == 0:
             continue
-        str_time = f'{time:02}'
+        str_time = f'{part:02}'
         times.append(str_time)
     return f'{":".join(times)} {"left" if s <= 0 else ""}'
 
 
 class QueueListSource(BaseListSource):
-    def __init__(self, player: Player, *, per_page):
-        super().__init__(player.queue._queue, per_page=per_page)
+    def __init__(self, player: Player, *, per_page: int = 10):
+        super().__init__(player.queue, per_page=per_page)
+        self.player = player
 
-    async def format_page(self, view: PaginatorView, page: list[Track]):
+    def get_max_pages(self) -> int:
+        return max(1, -(-len(self.entries) // self.per_page))
+
+    @property
+    def version(self):
+        # the eta column depends on the playing track, it is re-rendered every few seconds
+        source = self.player.source
+        return self.player.queue.version, id(source), int(self.player.position // 5)
+
+    async def format_page(self, view: PaginatorView, page: list[QueuedTrack]):
         offset = self.per_page*view.current_page+1
 
         emb = self.base_embed(view, page)
@@ -45,49 +106,459 @@ class QueueListSource(BaseListSource):
             value='\n'.join([f'{i}. {track}' for i, track in enumerate(page, offset)])
         )
         emb.add_field(name='Length', value='\n'.join([
-            humanize_seconds(
-                int((discord.utils.utcnow() - self.player.start).total_seconds()) - track.length//1000
-            )
-            if self.player.queue.next == offset+i else humanize_seconds(track.length//1000)
-            for i, track in enumerate(page)
+            humanize_seconds(int(track.length)) if track.length else '?'
+            for track in page
         ]))
 
+        queue = self.player.queue
+        eta = self.player.time_until(offset - 1)
+        etas = []
+        for track in page:
+            etas.append(humanize_seconds(int(eta)))
+            eta += queue.length(track)
+        emb.add_field(name='Через', value='\n'.join(etas))
+        emb.description = f'Общая длительность: {humanize_seconds(int(queue.duration))}'
+        if (gap := self.player.average_gap) is not None:
+            emb.description += f'\nПауза между треками: {gap * 1000:.0f} мс'
+        return emb
+
 class Player(wavelink.Player):
-    def __init__(self, interaction: discord.Interaction):
-        super().__init__()
-        self.dj = interaction.user
-        self.state_channel = interaction.channel
-        self.now_playing_message: discord.Message = None
+    def __init__(
+        self,
+        state_channel: discord.abc.Messageable,
+        *,
+        dj: Optional[discord.abc.User] = None,
+        node: wavelink.Node = MISSING,
+    ):
+        super().__init__(node=node)
+        self.queue: TrackQueue[QueuedTrack] = TrackQueue(
+            history=getenv('QUEUE_HISTORY', 50, int),
+            tokens=lambda track: tokenize(f'{track.title} {track.author or ""}'),
+        )
+        self.dj = dj
+        self.fair = FairScheduler(by_length=FAIR_QUEUE == 'length') if FAIR_QUEUE else None
+        if self.fair is not None and dj is not None:
+            self.fair.weights[dj.id] = FAIR_DJ_WEIGHT
+        self.state_channel = state_channel
+        self.now_playing = NowPlaying(
+            self.state_channel,
+            buckets=channel_buckets,
+            delay=getenv('NOW_PLAYING_DELAY', 1.0, float),
+        )
+        # partial track -> the task resolving it, the loop only holds weak references to tasks
+        self.prefetching: dict[QueuedTrack, asyncio.Task] = {}
+        self.ended_at: Optional[float] = None
+        self.gaps: collections.deque[float] = collections.deque(maxlen=50)
+        # inactivity reason -> when it was first seen, see MusicCog.reap
+        self.inactive: dict[str, float] = {}
+
+    def inactivity(self) -> list[str]:
+        reasons = []
+        if not any(not member.bot for member in self.channel.members):
+            reasons.append('empty')
+        if not self.is_playing() and self.queue.is_empty:
+            reasons.append('idle')
+        if self.is_paused():
+            reasons.append('paused')
+        return reasons
+
+    def time_until(self, index: int) -> float:
+        """Seconds until the queued track at ``index`` starts"""
+        eta = self.queue.eta(index)
+        if self.source is not None:
+            eta += max(self.source.length - self.position, 0)
+        return eta
+
+    @property
+    def average_gap(self) -> Optional[float]:
+        """Average time between a track ending and the next one starting, in seconds"""
+        if self.gaps:
+            return sum(self.gaps) / len(self.gaps)
+
+
+def encode_track(track: Union[QueuedTrack, wavelink.abc.Playable]) -> dict:
+    # the playing track is a full wavelink track, built from its queue entry
+    if not isinstance(track, QueuedTrack):
+        # tracks played from the audio cache are stored as what they cache
+        track = getattr(track, 'entry', None) or QueuedTrack.from_track(track, getattr(track, 'requester_id', None))
+    return track.encode()
+
+
+def player_state(player: Player) -> dict:
+    # tracks are encoded by QueueStore.flush, off the event loop
+    return {
+        'voice': player.channel.id,
+        'text': player.state_channel.id,  # type: ignore
+        'volume': player.volume,
+        'current': player.source,
+        'position': int(player.position * 1000),
+        'queue': list(player.queue),
+    }
+
+
+SPOTIFY_PAGE_URL = 'https://api.spotify.com/v1/{type}s/{id}/tracks'
+SPOTIFY_TRACK_URL = 'https://api.spotify.com/v1/tracks/{id}'
+SPOTIFY_PAGE_LIMITS = {
+    spotify.SpotifySearchType.album: 50,
+    spotify.SpotifySearchType.playlist: 100,
+}
+
+
+async def spotify_get(client: spotify.SpotifyClient, url: str, params: Optional[dict] = None) -> dict:
+    if not client._bearer_token or time.time() >= client._expiry:
+        await client._get_bearer_token()
+    async with client.session.get(url, headers=client.bearer_headers, params=params) as resp:
+        if resp.status != 200:
+            raise spotify.SpotifyRequestError(resp.status, resp.reason)
+        return await resp.json()
+
+
+async def iter_spotify_tracks(
+    decoded: dict, *, timings: Optional[Histogram] = None, resolved: Optional[ResolvedStore] = None
+) -> AsyncIterator[list[QueuedTrack]]:
+    # SpotifyTrack.iterator fetches every page before yielding anything,
+    # so pages are requested here and yielded as soon as they arrive
+    client: spotify.SpotifyClient = best_node()._spotify
+    url = SPOTIFY_PAGE_URL.format(type=decoded['type'].name, id=decoded['id'])
+    params = {'limit': SPOTIFY_PAGE_LIMITS[decoded['type']]}
+    while url:
+        with timings.time(kind='spotify_page') if timings else contextlib.nullcontext():
+            data = await spotify_get(client, url, params)
+
+        items = data['items']
+        if decoded['type'] is spotify.SpotifySearchType.playlist:
+            items = [item['track'] for item in items]
+        page = [
+            QueuedTrack.partial(
+                f'{item["name"]} - {item["artists"][0]["name"]}',
+                title=item['name'],
+                author=item['artists'][0]['name'],
+                length=item.get('duration_ms', 0) / 1000,
+                spotify_id=item.get('id'),  # local files have none
+            )
+            for item in items if item  # removed tracks are null
+        ]
+        if resolved is not None:
+            # tracks played before need no search
+            found = await resolved.get_many([track.spotify_id for track in page if track.spotify_id])
+            page = [track.resolved(found[track.spotify_id]) if track.spotify_id in found else track for track in page]
+        yield page
+        url, params = data['next'], None
 
 
-async def get_spotify_tracks(decoded: dict):
+async def get_spotify_tracks(
+    decoded: dict, *, timings: Optional[Histogram] = None, resolved: Optional[ResolvedStore] = None
+):
     if decoded['type'] == spotify.SpotifySearchType.track:
-        return [await spotify.SpotifyTrack.search(decoded['id'], return_first=True)]
+        if resolved is not None and (track := await resolved.get(decoded['id'])) is not None:
+            return [track]
+        # SpotifyTrack.search looks the track up on NodePool.get_node(), which can be a dead node
+        node = best_node()
+        with timings.time(kind='spotify_track') if timings else contextlib.nullcontext():
+            item = await spotify_get(node._spotify, SPOTIFY_TRACK_URL.format(id=decoded['id']))
+            found = await wavelink.YouTubeTrack.search(
+                query=f'{item["name"]} - {item["artists"][0]["name"]}', node=node
+            )
+        if not found:
+            return []
+        track = QueuedTrack.from_track(found[0])
+        if resolved is not None:
+            resolved.put(decoded['id'], track)
+        return [track]
         # return [wavelink.PartialTrack(query=decoded['id'], cls=spotify.SpotifyTrack)]
     else:
         tracks = []
-        async for track in spotify.SpotifyTrack.iterator(query=decoded['id'], type=decoded['type'], partial_tracks=True):
-            tracks.append(track)
+        async for page in iter_spotify_tracks(decoded, timings=timings, resolved=resolved):
+            tracks.extend(page)
         return tracks
 
 
 
+PROGRESS_EDIT_INTERVAL = 2
+
+
+def enqueued_embed(
+    inter: discord.Interaction, tracks: list[QueuedTrack], count: int, *, loading: bool = False, wait: float = 0.0
+):
+    if count == 1:
+        description = f'Трек {tracks[0].title} [{inter.user.mention}] добавлен в очередь'
+    else:
+        description = f'{count} треков [{inter.user.mention}] добавлено в очередь'
+    if wait > 0:
+        description += f', начнётся через {humanize_seconds(int(wait))}'
+    if loading:
+        description += '\N{HORIZONTAL ELLIPSIS}'
+    return discord.Embed(description=description, color=BaseListSource.BASE_COLOR)
+
+
 class MusicCog(commands.Cog):
     def __init__(self, bot: Bot) -> None:
         self.bot = bot
+        self.search_cache: TTLCache[str, list[QueuedTrack]] = TTLCache(
+            ttl=getenv('SEARCH_CACHE_TTL', 3600.0, float),
+            maxsize=getenv('SEARCH_CACHE_SIZE', 50_000, int),
+            sizeof=len,
+        )
+        # queries of partial tracks nothing was found for
+        self.no_matches: TTLCache[str, bool] = TTLCache(
+            ttl=getenv('NO_MATCH_CACHE_TTL', 600.0, float),
+            maxsize=getenv('NO_MATCH_CACHE_SIZE', 10_000, int),
+        )
+        self.lookups: SingleFlight[str, list[QueuedTrack]] = SingleFlight()
+        self.streams: dict[str, SharedIterator[list[QueuedTrack]]] = {}
+        self.prefetch_semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        self.suggestions = PrefixIndex(maxsize=getenv('AUTOCOMPLETE_INDEX_SIZE', 10_000, int))
+        # live searches for prefixes the index can't answer, per second
+        self.live_suggestions = RateLimiter(getenv('AUTOCOMPLETE_LIVE_RATE', 5, int), 1.0)
+        self.node_monitor = NodeMonitor(interval=getenv('NODE_HEALTH_INTERVAL', 0.5, float))
+        self.presence = PresenceScheduler(
+            bot,
+            policy=getenv('PRESENCE_POLICY', 'top'),
+            interval=getenv('PRESENCE_INTERVAL', 15.0, float),
+        )
+        self.store = QueueStore(getenv('QUEUE_DB', 'queues.sqlite3'), encode=encode_track)
+        # spotify id -> the track its search found, kept across restarts
+        self.resolved = ResolvedStore(
+            getenv('RESOLVED_DB', 'resolved.sqlite3'),
+            encode=QueuedTrack.encode,
+            decode=QueuedTrack.decode,
+            max_age=getenv('RESOLVED_MAX_AGE', 30 * 86400.0, float),
+            maxsize=getenv('RESOLVED_MAX_SIZE', 1_000_000, int),
+        )
+        self.restored: dict[int, dict] = {}
+        self._ready_task: Optional[asyncio.Task] = None
+        self.position_at = time.monotonic()
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        await wavelink.NodePool.create_node(
-            bot=self.bot,
-            host='127.0.0.1',
-            port=2333,
-            password='youshallnotpass',
-            spotify_client=spotify.SpotifyClient(
-                client_id=os.environ.get('SPOTIFY_CLIENT_ID'),
-                client_secret=os.environ.get('SPOTIFY_CLIENT_SECRET')
+        metrics = bot.metrics
+        self.search_timings = metrics.histogram('search_seconds', 'Remote track searches and Spotify requests', ('kind',))
+        self.gap_timings = metrics.histogram('transition_gap_seconds', 'Time from a track ending to the next one starting')
+        self.cache_lookups = metrics.counter('search_cache_lookups_total', 'Search cache lookups', ('result',))
+        self.shared_lookups = metrics.counter('shared_lookups_total', 'Searches that joined one already in flight')
+        self.rate_limit_waits = metrics.counter(
+            'ratelimit_wait_seconds_total', 'Time spent waiting on rate limits', ('source',)
+        )
+        self.node_players = metrics.gauge('node_players', 'Players per Lavalink node', ('node',))
+        self.queued_tracks = metrics.gauge('queued_tracks', 'Tracks queued across all players')
+        self.longest_queue = metrics.gauge('queue_length_max', 'Length of the longest queue')
+        self.autocompletes = metrics.counter('autocomplete_total', '/play autocomplete answers by source', ('source',))
+        self.reaped = metrics.counter('players_reaped_total', 'Inactive players disconnected', ('reason',))
+        # plays from disk, off unless a directory and an upstream to fill it from are set
+        self.audio_cache: Optional[AudioCache] = None
+        if (directory := getenv('AUDIO_CACHE_DIR', '')) and (url := getenv('AUDIO_CACHE_URL', '')):
+            self.audio_cache = AudioCache(
+                directory,
+                url,
+                lavalink_directory=getenv('AUDIO_CACHE_LAVALINK_DIR', directory),
+                max_bytes=getenv('AUDIO_CACHE_SIZE', 10 * 2**30, int),
+                min_plays=getenv('AUDIO_CACHE_MIN_PLAYS', 3.0, float),
+                half_life=getenv('AUDIO_CACHE_HALF_LIFE', 86400.0, float),
+                downloads=getenv('AUDIO_CACHE_DOWNLOADS', 2, int),
             )
+        self.audio_cache_plays = metrics.counter('audio_cache_plays_total', 'Plays by audio cache result', ('result',))
+        self.audio_cache_downloads = metrics.counter(
+            'audio_cache_downloads_total', 'Audio cache downloads by result', ('result',)
+        )
+        self.audio_cache_evictions = metrics.counter('audio_cache_evictions_total', 'Files dropped from the audio cache')
+        self.audio_cache_bytes = metrics.gauge('audio_cache_bytes', 'Size of the audio cache on disk')
+        self.resolved_lookups = metrics.counter(
+            'resolved_lookups_total', 'Lookups of Spotify tracks resolved before', ('result',)
         )
+        self.resolved_size = metrics.gauge('resolved_tracks', 'Spotify tracks with a stored resolution')
+
+    def collect_metrics(self) -> None:
+        self.cache_lookups.set(self.search_cache.hits, result='hit')
+        self.cache_lookups.set(self.search_cache.misses, result='miss')
+        self.shared_lookups.set(self.lookups.shared)
+        self.resolved_lookups.set(self.resolved.hits, result='hit')
+        self.resolved_lookups.set(self.resolved.misses, result='miss')
+        self.resolved_size.set(self.resolved.size)
+        if (cache := self.audio_cache) is not None:
+            self.audio_cache_plays.set(cache.hits, result='hit')
+            self.audio_cache_plays.set(cache.misses, result='miss')
+            for result, count in cache.downloads.items():
+                self.audio_cache_downloads.set(count, result=result)
+            self.audio_cache_evictions.set(cache.evicted)
+            self.audio_cache_bytes.set(cache.size)
+        self.rate_limit_waits.set(channel_buckets.waited, source='now_playing')
+
+        self.node_players.clear()
+        for node in wavelink.NodePool._nodes.values():
+            self.node_players.set(len(node.players), node=node.identifier)
+        lengths = [player.queue.count for player in self.players()]
+        self.queued_tracks.set(sum(lengths))
+        self.longest_queue.set(max(lengths, default=0))
+
+    async def cog_load(self) -> None:
+        self.bot.metrics.collectors.append(self.collect_metrics)
+        self.presence.start()
+        # on a reload the players keep playing, only their journal moves to the new store
+        live = self.players()
+        for guild_id, state in (await self.store.load()).items():
+            if not any(player.guild.id == guild_id for player in live):
+                self.restored[guild_id] = state
+        for player in live:
+            self.watch(player)
+        self.persist.start()
+        self.reap.start()
+        if self.bot.is_ready():
+            # on_ready won't fire again
+            self._ready_task = asyncio.create_task(self.ready())
+
+    async def cog_unload(self) -> None:
+        self.bot.metrics.collectors.remove(self.collect_metrics)
+        self.node_monitor.stop()
+        self.presence.stop()
+        self.persist.cancel()
+        self.reap.cancel()
+        if self._ready_task is not None:
+            self._ready_task.cancel()
+        for player in self.players():
+            self.store.snapshot(player.guild.id, player_state(player))
+        await self.store.flush()
+        self.store.close()
+        await self.resolved.flush()
+        self.resolved.close()
+        if self.audio_cache is not None:
+            await self.audio_cache.close()
+
+    def players(self) -> list[Player]:
+        # players made before a reload are instances of the old Player class
+        return [
+            vc for vc in self.bot.voice_clients  # type: ignore
+            if isinstance(vc, wavelink.Player) and isinstance(getattr(vc, 'queue', None), TrackQueue)
+        ]
+
+    def watch(self, player: Player) -> None:
+        guild_id = player.guild.id
+        player.queue.listener = lambda op, *args: self.store.record(guild_id, op, *args)
+        self.store.snapshot(guild_id, player_state(player))
+
+    @tasks.loop(seconds=JOURNAL_FLUSH_INTERVAL)
+    async def persist(self) -> None:
+        full = time.monotonic() - self.position_at >= POSITION_INTERVAL
+        if full:
+            self.position_at = time.monotonic()
+        for player in self.players():
+            guild_id = player.guild.id
+            if full and player.source is not None:
+                self.store.record(guild_id, 'position', int(player.position * 1000))
+            # only guilds whose journal grew long are snapshotted, unchanged queues cost nothing
+            if self.store.journal_sizes[guild_id] >= SNAPSHOT_JOURNAL_SIZE:
+                self.store.snapshot(guild_id, player_state(player))
+        try:
+            await self.store.flush()
+        except Exception:
+            log.exception('Could not write the queue journal, retrying on the next flush')
+        try:
+            await self.resolved.flush()
+            if full:
+                await self.resolved.evict()
+        except Exception:
+            log.exception('Could not write the resolved tracks, retrying on the next flush')
+
+    @tasks.loop(seconds=REAP_INTERVAL)
+    async def reap(self) -> None:
+        now = time.monotonic()
+        for player in self.players():
+            reasons = player.inactivity()
+            player.inactive = {reason: player.inactive.get(reason, now) for reason in reasons}
+            for reason, since in player.inactive.items():
+                if REAP_AFTER[reason] and now - since >= REAP_AFTER[reason]:
+                    try:
+                        await self.reap_player(player, reason)
+                    except Exception:
+                        log.exception('Could not reap the player of guild %s', player.guild.id)
+                    break
+
+    async def reap_player(self, player: Player, reason: str) -> None:
+        """Disconnect ``player``, destroying its Lavalink player and dropping its state"""
+        guild_id = player.guild.id
+        log.info('Disconnecting the player of guild %s: %s', guild_id, reason)
+        self.reaped.inc(reason=reason)
+
+        if REAP_PARK and (player.queue.count or player.source is not None):
+            state = player_state(player)
+            # parked, a later /connect reads it back from the store
+            state['voice'] = None
+            self.store.snapshot(guild_id, state)
+        else:
+            self.store.forget(guild_id)
+        # nothing may be journaled or played after this
+        player.queue.listener = None
+        player.queue.clear()
+
+        await player.now_playing.close()
+        await player.disconnect()
+        self.presence.mark()
+
+    async def unpark(self, player: Player) -> int:
+        """Put back the queue a reaped player left in this guild"""
+        try:
+            state = (await self.store.load(player.guild.id)).get(player.guild.id)
+        except Exception:
+            log.exception('Could not read the parked queue of guild %s', player.guild.id)
+            return 0
+        if state is None or state['voice'] is not None:
+            return 0
+        tracks = [QueuedTrack.decode(data) for data in state['queue']]
+        if state['current'] is not None:
+            tracks.insert(0, QueuedTrack.decode(state['current']))
+        player.queue.extend(tracks)
+        if player.fair is not None:
+            player.fair.restore(tracks)
+        return len(tracks)
+
+    async def restore_players(self) -> None:
+        # other cluster workers restore the guilds on their shards
+        states = {guild_id: state for guild_id, state in self.restored.items() if self.bot.owns_guild(guild_id)}
+        self.restored = {}
+        await asyncio.gather(*(self.restore_player(guild_id, state) for guild_id, state in states.items()))
+
+    async def restore_player(self, guild_id: int, state: dict) -> None:
+        guild = self.bot.get_guild(guild_id)
+        channel = guild and guild.get_channel(state['voice'])
+        text_channel = guild and guild.get_channel(state['text'])
+        if channel is None or text_channel is None or guild.voice_client is not None:
+            self.store.forget(guild_id)
+            return
+
+        try:
+            vc: Player = await channel.connect(cls=Player(text_channel, node=best_node(channel.rtc_region)))  # type: ignore
+            vc.queue.extend(QueuedTrack.decode(data) for data in state['queue'])
+            if vc.fair is not None:
+                vc.fair.restore(vc.queue)
+            self.watch(vc)
+            if state['volume'] != 100:
+                await vc.set_volume(state['volume'])
+            if state['current'] is not None:
+                current = QueuedTrack.decode(state['current'])
+                if current.is_partial:
+                    current = await self.resolve_partial(current)
+                await vc.play(current.build(), start=state['position'])
+            elif vc.queue.count:
+                await self.play_next(vc)
+        except Exception:
+            log.exception('Could not restore the player of guild %s', guild_id)
+
+    async def nodes_ready(self) -> None:
+        if self.bot.nodes_ready is not None:
+            await asyncio.shield(self.bot.nodes_ready)
+
+    async def interaction_check(self, inter: discord.Interaction) -> bool:
+        # commands arriving right after startup wait for the node connect instead of failing
+        await self.nodes_ready()
+        return True
+
+    async def ready(self) -> None:
+        await self.nodes_ready()
+        self.node_monitor.start()
+        await self.restore_players()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # nodes are connected by Bot.setup_hook and retried by the node monitor,
+        # reconnects only retry the restore
+        await self.ready()
 
     @app_commands.command()
     @app_commands.describe(channel='Channel for connecting')
@@ -97,16 +568,181 @@ class MusicCog(commands.Cog):
         channel: Optional[Union[discord.VoiceChannel, discord.StageChannel]] = None
     ) -> Player:
         """Connect to the voice channel"""
+        return await self.join(inter, channel, unpark=True)
+
+    async def join(
+        self,
+        inter: discord.Interaction,
+        channel: Optional[Union[discord.VoiceChannel, discord.StageChannel]] = None,
+        *,
+        unpark: bool = False,
+    ) -> Player:
         channel = channel or inter.user.voice.channel
         if channel is None:
             raise Exception  # TODO
 
-        vc = await channel.connect(cls=Player(inter))
-        emb = discord.Embed(description=f'Подключён к {channel.mention}', color=BaseListSource.BASE_COLOR)
+        vc = await channel.connect(cls=Player(inter.channel, dj=inter.user, node=best_node(channel.rtc_region)))
+        # a parked queue only comes back on an explicit /connect, not ahead of a /play request
+        parked = await self.unpark(vc) if unpark else 0
+        self.watch(vc)
+        description = f'Подключён к {channel.mention}'
+        if parked:
+            description += f', в очередь возвращено треков: {parked}'
+        emb = discord.Embed(description=description, color=BaseListSource.BASE_COLOR)
         await send(inter, embed=emb)
 
         return vc
-    
+
+    @staticmethod
+    def query_key(query: str) -> tuple[str, Optional[dict]]:
+        if decoded := spotify.decode_url(query):
+            return f'spotify:{decoded["type"].name}:{decoded["id"]}', decoded
+        return normalize_query(query), None
+
+    async def resolve_tracks(self, query: str) -> list[QueuedTrack]:
+        key, decoded = self.query_key(query)
+
+        async def lookup() -> list[QueuedTrack]:
+            if decoded:
+                tracks = await get_spotify_tracks(decoded, timings=self.search_timings, resolved=self.resolved)
+            else:
+                with self.search_timings.time(kind='youtube'):
+                    found = await wavelink.YouTubeTrack.search(query=query, node=best_node())
+                tracks = [QueuedTrack.from_track(found[0])] if found else []
+            if tracks:
+                self.search_cache[key] = tracks
+            return tracks
+
+        tracks = self.search_cache.get(key)
+        if tracks is None:
+            tracks = await self.lookups.do(key, lookup)
+        return tracks
+
+    async def iter_tracks(self, query: str) -> AsyncIterator[list[QueuedTrack]]:
+        """Yield resolved tracks page by page, playlists are streamed as they load"""
+        key, decoded = self.query_key(query)
+        if (
+            decoded is None
+            or decoded['type'] is spotify.SpotifySearchType.track
+            or key in self.search_cache
+        ):
+            yield await self.resolve_tracks(query)
+            return
+
+        if (stream := self.streams.get(key)) is None:
+            stream = self.streams[key] = SharedIterator(
+                iter_spotify_tracks(decoded, timings=self.search_timings, resolved=self.resolved)
+            )
+
+            def done(task):
+                del self.streams[key]
+                if not task.cancelled() and stream.error is None:
+                    self.search_cache[key] = [track for page in stream.items for track in page]
+
+            stream.task.add_done_callback(done)
+
+        async for page in stream:
+            yield page
+
+    async def resolve_partial(self, partial: QueuedTrack) -> QueuedTrack:
+        key = normalize_query(partial.query)  # type: ignore
+
+        async def lookup() -> list[QueuedTrack]:
+            if partial.spotify_id and (track := await self.resolved.get(partial.spotify_id)) is not None:
+                self.search_cache[key] = [track]
+                return [track]
+            for attempt in range(PREFETCH_RETRIES):
+                try:
+                    with self.search_timings.time(kind='partial'):
+                        found = await wavelink.YouTubeTrack.search(query=partial.query, node=best_node())
+                except Exception:
+                    if attempt == PREFETCH_RETRIES - 1:
+                        raise
+                    await asyncio.sleep(2 ** attempt)
+                else:
+                    if not found:
+                        self.no_matches[key] = True
+                        raise NoMatches(partial.query)
+                    track = QueuedTrack.from_track(found[0])
+                    self.search_cache[key] = [track]
+                    if partial.spotify_id:
+                        self.resolved.put(partial.spotify_id, track)
+                    return [track]
+
+        if key in self.no_matches:
+            raise NoMatches(partial.query)
+        tracks = self.search_cache.get(key)
+        if tracks is None:
+            tracks = await self.lookups.do(key, lookup)
+        return partial.resolved(tracks[0])
+
+    def prefetch(self, player: Player) -> None:
+        """Start resolving partial tracks at the head of the queue in the background"""
+        for track in player.queue[:PREFETCH_WINDOW]:
+            if track.is_partial and track not in player.prefetching:
+                task = player.prefetching[track] = asyncio.create_task(self._prefetch_one(player, track))
+                task.add_done_callback(lambda _, track=track: player.prefetching.pop(track, None))
+
+    async def _prefetch_one(self, player: Player, partial: QueuedTrack) -> None:
+        try:
+            async with self.prefetch_semaphore:
+                track = await self.resolve_partial(partial)
+        except NoMatches:
+            # play_next skips it
+            return
+        except Exception:
+            log.warning('Could not prefetch %r', partial.query, exc_info=True)
+            return
+
+        # if it was dequeued or moved away already, play_next finds the result in the cache
+        for i, queued in enumerate(player.queue[:PREFETCH_WINDOW]):
+            if queued is partial:
+                player.queue[i] = track
+                break
+
+    async def play_next(self, player: Player) -> None:
+        while True:
+            track = await player.queue.get_wait()
+            if player.fair is not None:
+                player.fair.served(track)
+            if not track.is_partial:
+                break
+            try:
+                track = await self.resolve_partial(track)
+                break
+            except Exception as e:
+                log.warning('Skipping %r, it could not be resolved', track.query, exc_info=not isinstance(e, NoMatches))
+                if player.queue.is_empty:
+                    self.stopped(player)
+                    return
+        await player.play(await self.playable(player, track))
+        self.prefetch(player)
+
+    def stopped(self, player: Player) -> None:
+        """The queue ran out"""
+        player.ended_at = None
+        self.store.record(player.guild.id, 'current', None, 0)
+        player.now_playing.update(None)
+        self.presence.mark()
+
+    async def playable(self, player: Player, track: QueuedTrack) -> wavelink.abc.Playable:
+        if self.audio_cache is not None:
+            self.audio_cache.record(track)
+            if (local := await self.audio_cache.playable(player.node, track)) is not None:
+                return local
+        return track.build()
+
+    def enqueue(self, player: Player, tracks: list[QueuedTrack], requester: discord.abc.User) -> int:
+        """Queue a batch of tracks, returns the index of the first one"""
+        # search results are shared between guilds, every queue gets its own entries
+        tracks = [track.copy(requester_id=requester.id) for track in tracks]
+        if player.fair is not None:
+            return player.fair.enqueue(player.queue, tracks)
+        # first come first served is one operation (and one journal entry)
+        first = player.queue.count
+        player.queue.extend(tracks)
+        return first
+
     @app_commands.command()
     @app_commands.describe(query='Search query')
     async def play(
@@ -116,61 +752,189 @@ class MusicCog(commands.Cog):
     ) -> None:
         """Play tracks with given query (Spotify supported)"""
         if not (vc := inter.guild.voice_client):
-            vc: wavelink.Player = await self.connect.callback(self, inter)
+            vc = await self.join(inter)
         else:
             await inter.response.defer()
 
-        if decoded := spotify.decode_url(query):
-            tracks: list[Track] = await get_spotify_tracks(decoded)  # type: ignore
-        else:
-            tracks: list[Track] = [await wavelink.YouTubeTrack.search(query=query, return_first=True)]  # type: ignore
+        message: Optional[discord.Message] = None
+        edited_at = 0.0
+        count = pages = 0
+        tracks: list[QueuedTrack] = []
+        wait: Optional[float] = None
+        async for page in self.iter_tracks(query):
+            pages += 1
+            tracks = page or tracks
+            first = self.enqueue(vc, page, inter.user)
+            if wait is None and page:
+                wait = vc.time_until(first) if vc.is_playing() else 0.0
+            count += len(page)
+
+            if vc.queue.count and not vc.is_playing():
+                await self.play_next(vc)
+            else:
+                self.prefetch(vc)
 
-        if not tracks:
+            # single page results are reported once, after the loop
+            if pages > 1 and time.monotonic() - edited_at >= PROGRESS_EDIT_INTERVAL:
+                emb = enqueued_embed(inter, tracks, count, loading=True, wait=wait or 0.0)
+                if message is None:
+                    message = await send(inter, embed=emb, wait=True)
+                else:
+                    await message.edit(embed=emb)
+                edited_at = time.monotonic()
+
+        if not count:
             raise Exception  # TODO
-        
-        for track in tracks:
-            track.requester = inter.user
-            vc.queue.put(track)
-        if len(tracks) == 1:
-            track = tracks[0]
-            emb = discord.Embed(
-                description=f'Трек {track.title} [{inter.user.mention}] добавлен в очередь',
-                color=BaseListSource.BASE_COLOR
-            )
+
+        emb = enqueued_embed(inter, tracks, count, wait=wait or 0.0)
+        if message is None:
+            await send(inter, embed=emb)
         else:
-            emb = discord.Embed(
-                description=f'{len(tracks)} треков [{inter.user.mention}] добавлено в очередь',
-                color=BaseListSource.BASE_COLOR
-            )
-        await send(inter, embed=emb)
-        
-        if vc.queue.count and not vc.is_playing():
-            await vc.play(await vc.queue.get_wait())
+            await message.edit(embed=emb)
     
+    @play.autocomplete('query')
+    async def play_autocomplete(self, inter: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+        suggestions = self.suggestions.lookup(current)
+        source = 'index'
+        if not suggestions:
+            if len(current) < 3 or '://' in current:
+                source = 'miss'
+            elif not self.live_suggestions.acquire():
+                source = 'limited'
+            else:
+                source = 'live'
+                suggestions = await self.live_suggest(current)
+        self.autocompletes.inc(source=source)
+        return [app_commands.Choice(name=text[:100], value=value[:100]) for text, value in suggestions]
+
+    async def live_suggest(self, query: str) -> list[tuple[str, str]]:
+        try:
+            with self.search_timings.time(kind='autocomplete'):
+                tracks = await asyncio.wait_for(
+                    wavelink.YouTubeTrack.search(query=query, node=best_node()), AUTOCOMPLETE_TIMEOUT
+                )
+        except Exception:
+            return []
+        return [(track.title, track.title) for track in tracks[:10]]
+
     @app_commands.command()
     async def queue(self, inter: discord.Interaction) -> None:
-        ...
+        """Show the current queue"""
+        vc: Optional[Player] = inter.guild.voice_client  # type: ignore
+        if vc is None or vc.queue.is_empty:
+            emb = discord.Embed(description='Очередь пуста', color=BaseListSource.BASE_COLOR)
+            return await send(inter, embed=emb, ephemeral=True)
+
+        view = PaginatorView(QueueListSource(vc), interaction=inter)
+        await view.start()
     
+    @staticmethod
+    def find_queued(player: Optional[Player], track: str) -> Optional[int]:
+        """Queue index of ``track``, a choice from the autocomplete or a typed title"""
+        if player is None:
+            return None
+        position, sep, title = track.partition(POSITION_SEPARATOR)
+        if not sep or not position.isdigit():
+            matches = player.queue.search(track, limit=1)
+            return matches[0][0] if matches else None
+
+        # tracks could have ended or been removed since the autocomplete, the title has to match
+        index = int(position) - 1
+        if 0 <= index < player.queue.count and player.queue[index].title.startswith(title):
+            return index
+        for index, queued in player.queue.search(title):
+            if queued.title.startswith(title):
+                return index
+        return None
+
+    @staticmethod
+    def not_found(track: str) -> discord.Embed:
+        title = track.rpartition(POSITION_SEPARATOR)[2]
+        return discord.Embed(description=f'В очереди нет трека «{title}»', color=BaseListSource.BASE_COLOR)
+
+    async def queued_autocomplete(self, inter: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+        vc: Optional[Player] = inter.guild.voice_client  # type: ignore
+        if vc is None:
+            return []
+        matches = vc.queue.search(current, limit=25) if current.strip() else enumerate(vc.queue[:25])
+        return [
+            app_commands.Choice(name=f'{i + 1}. {track}'[:100], value=f'{i + 1}{POSITION_SEPARATOR}{track.title}'[:100])
+            for i, track in matches
+        ]
+
+    @app_commands.command()
+    @app_commands.describe(query='Words from a title or an author')
+    async def search(self, inter: discord.Interaction, query: str) -> None:
+        """Find tracks in the queue"""
+        vc: Optional[Player] = inter.guild.voice_client  # type: ignore
+        matches = vc.queue.search(query) if vc is not None else []
+        emb = discord.Embed(title='\N{LEFT-POINTING MAGNIFYING GLASS} Поиск в очереди', color=BaseListSource.BASE_COLOR)
+        if not matches:
+            emb.description = 'Ничего не найдено'
+        else:
+            lines = [f'{i + 1}. {track}' for i, track in matches[:20]]
+            if len(matches) > 20:
+                lines.append(f'...и ещё {len(matches) - 20}')
+            emb.description = '\n'.join(lines)
+        await send(inter, embed=emb, ephemeral=True)
+
+    @app_commands.command()
+    @app_commands.describe(track='Track to jump to')
+    async def jump(self, inter: discord.Interaction, track: str) -> None:
+        """Skip to a track in the queue"""
+        vc: Optional[Player] = inter.guild.voice_client  # type: ignore
+        if (index := self.find_queued(vc, track)) is None:
+            return await send(inter, embed=self.not_found(track), ephemeral=True)
+        await inter.response.defer()
+        queued = vc.queue[index]
+        vc.queue.jump(index)
+        if vc.is_playing():
+            # track end plays it next
+            await vc.stop()
+        else:
+            await self.play_next(vc)
+        await send(inter, embed=discord.Embed(description=f'Переход к **{queued}**', color=BaseListSource.BASE_COLOR))
+
+    @app_commands.command()
+    @app_commands.describe(track='Track to remove')
+    async def remove(self, inter: discord.Interaction, track: str) -> None:
+        """Remove a track from the queue"""
+        vc: Optional[Player] = inter.guild.voice_client  # type: ignore
+        if (index := self.find_queued(vc, track)) is None:
+            return await send(inter, embed=self.not_found(track), ephemeral=True)
+        removed = vc.queue.remove(index)
+        await send(inter, embed=discord.Embed(description=f'Удалён **{removed}**', color=BaseListSource.BASE_COLOR))
+
+    jump.autocomplete('track')(queued_autocomplete)
+    remove.autocomplete('track')(queued_autocomplete)
+
     @commands.Cog.listener()
     async def on_wavelink_track_start(self, player: Player, track: wavelink.YouTubeTrack):
-        activity = discord.Activity(name=track.title, type=discord.ActivityType.listening)
-        await self.bot.change_presence(activity=activity)
+        if player.ended_at is not None:
+            player.gaps.append(time.perf_counter() - player.ended_at)
+            self.gap_timings.observe(player.gaps[-1])
+            player.ended_at = None
+        if player.source is not None:
+            self.store.record(player.guild.id, 'current', player.source, 0)
+        self.presence.mark()
+        # the index is shared by all guilds, so it only learns titles of played tracks, never typed queries
+        self.suggestions.add(track.title)
         emb = discord.Embed(
             title='\N{MUSICAL NOTE} Сейчас играет',
-            description=f'[{track.title}]({track.uri})'  # [{track.requester.mention}]
+            description=f'[{track.title}]({track.uri})'  # [<@{track.requester_id}>]
         )
-        player.now_playing_message = await player.state_channel.send(embed=emb)
+        player.now_playing.update(emb)
     
     @commands.Cog.listener()
     async def on_wavelink_track_end(self, player: Player, track: wavelink.YouTubeTrack, reason):
-        if player.now_playing_message:
-            await player.now_playing_message.delete()
-        
+        if not player.is_connected():
+            # reaped or disconnected, its state is already stored or dropped
+            return
+        player.ended_at = time.perf_counter()
         if player.queue.count and not player.is_playing():
-            new_track = await player.queue.get_wait()
-            await player.play(new_track)
+            await self.play_next(player)
         else:
-            await self.bot.change_presence(activity=None)
+            self.stopped(player)
 
 async def setup(bot: Bot):
     await bot.add_cog(MusicCog(bot), guilds=[discord.Object(824997091075555419)])
\ No newline at end of file
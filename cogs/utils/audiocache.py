@@ -0,0 +1,229 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import heapq
+import logging
+import os
+import time
+import urllib.parse
+from typing import Optional
+
+import aiohttp
+import wavelink
+
+from .tracks import QueuedTrack
+
+log = logging.getLogger(__name__)
+
+WRITE_SIZE = 2**20
+
+
+class _Entry:
+    __slots__ = ('score', 'at', 'size', 'local')
+
+    def __init__(self):
+        self.score = 0.0
+        self.at = 0.0
+        # bytes on disk, None while not cached
+        self.size: Optional[int] = None
+        # the lavalink track of the cached file, loaded on its first play
+        self.local: Optional[tuple[str, dict]] = None
+
+
+class AudioCache:
+    """Disk cache of the most played tracks' audio, played through Lavalink's local source.
+
+    Every play counts towards its track's score, decayed with ``half_life``
+    seconds. Tracks that reach ``min_plays`` are downloaded from ``url``, a
+    template taking the url-quoted track ``uri``, into ``directory``.
+    Once the files take more than ``max_bytes``, the lowest scored ones are
+    deleted, the least recently played first among equals. A full cache
+    only downloads tracks scored above its coldest file.
+
+    ``lavalink_directory`` is where the Lavalink nodes see ``directory``.
+    Plays fall back to streaming when a file can't be loaded there.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        url: str,
+        *,
+        lavalink_directory: Optional[str] = None,
+        max_bytes: int = 10 * 2**30,
+        min_plays: float = 3.0,
+        half_life: float = 86400.0,
+        downloads: int = 2,
+        maxsize: int = 100_000,
+    ):
+        self.directory = directory
+        self.url = url
+        self.lavalink_directory = lavalink_directory or directory
+        self.max_bytes = max_bytes
+        # one file may take a tenth of the budget at most
+        self.max_file = max_bytes // 10
+        self.min_plays = min_plays
+        self.half_life = half_life
+        self.maxsize = maxsize
+        self.entries: dict[str, _Entry] = {}
+        self.size = 0
+        self.hits = self.misses = self.evicted = 0
+        self.downloads: dict[str, int] = {'ok': 0, 'failed': 0, 'too_large': 0}
+        self._downloading: dict[str, asyncio.Task] = {}
+        # never tried again, long mixes and the like
+        self._too_large: set[str] = set()
+        self._semaphore = asyncio.Semaphore(downloads)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.part'):
+                os.remove(path)
+                continue
+            # files from before a restart start out just hot enough to stay
+            entry = self.entries[name] = _Entry()
+            entry.score = min_plays
+            entry.at = os.path.getmtime(path)
+            entry.size = os.path.getsize(path)
+            self.size += entry.size
+        self._evict()
+
+    @staticmethod
+    def key(track: QueuedTrack) -> Optional[str]:
+        if not track.uri or not track.length:
+            # streams have no length
+            return None
+        return hashlib.sha1(track.uri.encode()).hexdigest()[:20]
+
+    def _score(self, entry: _Entry, now: float) -> float:
+        return entry.score * 0.5 ** ((now - entry.at) / self.half_life)
+
+    def record(self, track: QueuedTrack) -> None:
+        """Count a play of ``track``, starts its download once it is hot"""
+        if (key := self.key(track)) is None:
+            return
+        now = time.time()
+        if (entry := self.entries.get(key)) is None:
+            if len(self.entries) >= self.maxsize:
+                self._forget(now)
+            entry = self.entries[key] = _Entry()
+        entry.score = self._score(entry, now) + 1
+        entry.at = now
+        if entry.size is not None or entry.score < self.min_plays:
+            return
+        if key not in self._downloading and key not in self._too_large and self._admit(entry.score, now):
+            task = self._downloading[key] = asyncio.create_task(self._download(key, track))
+            task.add_done_callback(lambda _: self._downloading.pop(key, None))
+
+    def _admit(self, score: float, now: float) -> bool:
+        if self.size + self.max_file <= self.max_bytes:
+            return True
+        # a full cache only takes tracks hotter than what they would push out
+        coldest = min((self._score(entry, now) for entry in self.entries.values() if entry.size), default=0.0)
+        return score > coldest
+
+    def _forget(self, now: float) -> None:
+        # play counts of tracks that aren't cached, the coldest tenth
+        count = max(1, self.maxsize // 10)
+        uncached = (key for key, entry in self.entries.items() if entry.size is None)
+        for key in heapq.nsmallest(count, uncached, key=lambda k: self._score(self.entries[k], now)):
+            del self.entries[key]
+
+    async def _download(self, key: str, track: QueuedTrack) -> None:
+        path = os.path.join(self.directory, key)
+        part = path + '.part'
+        url = self.url.format(uri=urllib.parse.quote(track.uri, safe=''))  # type: ignore
+        async with self._semaphore:
+            if self._session is None:
+                self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600))
+            size = 0
+            try:
+                async with self._session.get(url) as resp:
+                    resp.raise_for_status()
+                    if (resp.content_length or 0) > self.max_file:
+                        self._skip(key)
+                        return
+                    # file writes run in a thread, a buffered megabyte at a time
+                    f = await asyncio.to_thread(open, part, 'wb')
+                    try:
+                        buffer = bytearray()
+                        async for chunk in resp.content.iter_chunked(2**16):
+                            size += len(chunk)
+                            if size > self.max_file:
+                                self._skip(key)
+                                return
+                            buffer += chunk
+                            if len(buffer) >= WRITE_SIZE:
+                                await asyncio.to_thread(f.write, bytes(buffer))
+                                buffer.clear()
+                        await asyncio.to_thread(f.write, bytes(buffer))
+                    finally:
+                        await asyncio.to_thread(f.close)
+                os.replace(part, path)
+            except Exception:
+                log.warning('Could not cache %s', track.uri, exc_info=True)
+                self.downloads['failed'] += 1
+                return
+            finally:
+                if os.path.exists(part):
+                    os.remove(part)
+
+        self.downloads['ok'] += 1
+        entry = self.entries.setdefault(key, _Entry())
+        entry.size = size
+        entry.local = None
+        self.size += size
+        self._evict()
+
+    def _skip(self, key: str) -> None:
+        self.downloads['too_large'] += 1
+        self._too_large.add(key)
+
+    def _evict(self) -> None:
+        if self.size <= self.max_bytes:
+            return
+        now = time.time()
+        cached = [(self._score(entry, now), entry.at, key) for key, entry in self.entries.items() if entry.size]
+        heapq.heapify(cached)
+        while self.size > self.max_bytes and cached:
+            *_, key = heapq.heappop(cached)
+            entry = self.entries[key]
+            try:
+                os.remove(os.path.join(self.directory, key))
+            except FileNotFoundError:
+                pass
+            self.size -= entry.size  # type: ignore
+            entry.size = entry.local = None
+            self.evicted += 1
+
+    async def playable(self, node: wavelink.Node, track: QueuedTrack) -> Optional[wavelink.LocalTrack]:
+        """The cached file of ``track`` as a Lavalink local track, if there is one"""
+        key = self.key(track)
+        entry = self.entries.get(key) if key is not None else None
+        if entry is None or entry.size is None:
+            self.misses += 1
+            return None
+        if entry.local is None:
+            try:
+                tracks = await node.get_tracks(wavelink.LocalTrack, os.path.join(self.lavalink_directory, key))  # type: ignore
+            except Exception:
+                tracks = []
+            if not tracks:
+                log.warning('Lavalink node %s can not load the cached %s', node.identifier, track.uri)
+                self.misses += 1
+                return None
+            entry.local = (tracks[0].id, tracks[0].info)
+        self.hits += 1
+        id, info = entry.local
+        # shown and stored like the track it caches
+        local = wavelink.LocalTrack(id, {**info, 'title': track.title, 'author': track.author, 'uri': track.uri})
+        local.requester_id = track.requester_id  # type: ignore
+        local.entry = track  # type: ignore
+        return local
+
+    async def close(self) -> None:
+        for task in self._downloading.values():
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,157 @@
+from __future__ import annotations
+import asyncio
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+def normalize_query(query: str) -> str:
+    query = ' '.join(query.split())
+    if '://' in query:
+        # ids in urls are case sensitive
+        return query
+    return query.casefold()
+
+
+class TTLCache(Generic[K, V]):
+    """LRU mapping whose entries expire ``ttl`` seconds after being stored.
+
+    ``maxsize`` bounds the summed ``sizeof(value)`` of all entries, so a
+    cached playlist counts as many tracks rather than as a single item.
+    """
+
+    def __init__(self, *, ttl: float, maxsize: int, sizeof: Callable[[V], int] = lambda _: 1):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, tuple[float, int, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return self._lookup(key) is not None
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _lookup(self, key: K) -> Optional[tuple[float, int, V]]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._pop(key)
+            return None
+        return entry
+
+    def _pop(self, key: K) -> None:
+        _, size, _ = self._data.pop(key)
+        self.size -= size
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return entry[2]
+
+    def __setitem__(self, key: K, value: V) -> None:
+        size = self.sizeof(value)
+        if size > self.maxsize:
+            return
+        if key in self._data:
+            self._pop(key)
+        self._data[key] = (time.monotonic() + self.ttl, size, value)
+        self.size += size
+        while self.size > self.maxsize:
+            self._pop(next(iter(self._data)))
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        entry = self._lookup(key)
+        if entry is None:
+            return default
+        self._pop(key)
+        return entry[2]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.size = 0
+
+
+class SingleFlight(Generic[K, V]):
+    """Shares one in-flight call between concurrent callers with the same key.
+
+    The call runs as its own task, so a cancelled waiter does not cancel
+    the lookup for everyone else.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls: dict[K, asyncio.Future[V]] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: K, func: Callable[[], Awaitable[V]]) -> V:
+        try:
+            future = self._calls[key]
+        except KeyError:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(future)
+
+
+class SharedIterator(Generic[V]):
+    """Drains ``source`` once in the background and replays it to every reader.
+
+    Readers that join late first get everything produced so far, then
+    follow the source as new items arrive.
+    """
+
+    def __init__(self, source: AsyncIterator[V]):
+        self.items: list[V] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._run(source))
+
+    async def _run(self, source: AsyncIterator[V]) -> None:
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def __aiter__(self) -> AsyncIterator[V]:
+        i = 0
+        while True:
+            changed = self._changed
+            while i < len(self.items):
+                yield self.items[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
@@ -0,0 +1,73 @@
+from __future__ import annotations
+import bisect
+from typing import Iterable
+
+from .queue import TrackQueue
+from .tracks import QueuedTrack
+
+
+def turn_key(track: QueuedTrack) -> float:
+    # entries queued while fair mode was off go first, like they would have
+    return track.turn if track.turn is not None else float('-inf')
+
+
+class FairScheduler:
+    """Weighted fair queueing of tracks between requesters.
+
+    Every queued track gets a ``turn``: its requester's previous turn, or
+    the turn now playing if that is later, plus the track's cost over the
+    requester's weight. The cost is 1 per track or, with ``by_length``,
+    its length. The queue is kept ordered by turn, so the next track is
+    still its head and the queue's own ETA stays exact, and a new request
+    is queued behind at most about one turn of everybody else, however
+    long their playlists are.
+    """
+
+    def __init__(self, *, by_length: bool = False, default_length: float = 180.0):
+        self.by_length = by_length
+        self.default_length = default_length
+        self.weights: dict[int, float] = {}
+        # turn of the track being played
+        self.virtual = 0.0
+        # requester id -> turn of their last queued track
+        self.finish: dict[int, float] = {}
+
+    def cost(self, track: QueuedTrack) -> float:
+        cost = (track.length or self.default_length) if self.by_length else 1.0
+        return cost / self.weights.get(track.requester_id, 1.0)  # type: ignore
+
+    def stamp(self, tracks: list[QueuedTrack]) -> None:
+        for track in tracks:
+            turn = max(self.finish.get(track.requester_id, 0.0), self.virtual) + self.cost(track)  # type: ignore
+            track.turn = self.finish[track.requester_id] = turn  # type: ignore
+
+    def enqueue(self, queue: TrackQueue[QueuedTrack], tracks: list[QueuedTrack]) -> int:
+        """Stamp and place ``tracks`` in ``queue``, returns the index of the first one"""
+        self.stamp(tracks)
+        last = turn_key(queue[-1]) if queue else float('-inf')
+        # the part that sorts after the whole queue is appended in one go
+        split = bisect.bisect_right([track.turn for track in tracks], last)  # type: ignore
+        first = len(queue)
+        for i, track in enumerate(tracks[:split]):
+            index = queue.insort(track, key=turn_key)
+            if i == 0:
+                first = index
+        queue.extend(tracks[split:])
+        return first
+
+    def served(self, track: QueuedTrack) -> None:
+        if track.turn is not None:
+            self.virtual = max(self.virtual, track.turn)
+        if len(self.finish) > 256:
+            # turns behind the current one count as the current one anyway
+            self.finish = {requester: turn for requester, turn in self.finish.items() if turn > self.virtual}
+
+    def restore(self, tracks: Iterable[QueuedTrack]) -> None:
+        """Pick the state up from a restored queue"""
+        tracks = list(tracks)
+        self.finish.clear()
+        turns = [track.turn for track in tracks if track.turn is not None]
+        self.virtual = min(turns, default=0.0)
+        for track in tracks:
+            if track.turn is not None and track.requester_id is not None:
+                self.finish[track.requester_id] = max(self.finish.get(track.requester_id, 0.0), track.turn)
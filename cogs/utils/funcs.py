@@ -1,13 +1,23 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+import os
+from typing import TYPE_CHECKING, Callable, Optional, TypeVar
 
 from discord.utils import MISSING
 
 if TYPE_CHECKING:
     from typing import Any
-    from discord import Embed, File, AllowedMentions, Interaction
+    from discord import Embed, File, AllowedMentions, Interaction, Message
     from discord.ui.view import View
 
+T = TypeVar('T')
+
+
+def getenv(name: str, default: T, cast: Callable[[str], T] = str) -> T:
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return cast(value)
+
 
 async def send(
     interaction: Interaction,
@@ -21,13 +31,10 @@ async def send(
     view: View = MISSING,
     tts: bool = False,
     ephemeral: bool = False,
-) -> None:
-    if interaction.response._responded:
-        sender = interaction.followup.send
-    else:
-        sender = interaction.response.send_message
-    await sender(
-        content=content,  # type: ignore
+    wait: bool = False,
+) -> Optional[Message]:
+    kwargs = dict(
+        content=content,
         embed=embed,
         embeds=embeds,
         file=file,
@@ -36,4 +43,10 @@ async def send(
         view=view,
         tts=tts,
         ephemeral=ephemeral,
-    )
\ No newline at end of file
+    )
+    if interaction.response._responded:
+        return await interaction.followup.send(**kwargs, wait=wait)  # type: ignore
+
+    await interaction.response.send_message(**kwargs)  # type: ignore
+    if wait:
+        return await interaction.original_message()
\ No newline at end of file
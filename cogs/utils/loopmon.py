@@ -0,0 +1,197 @@
+from __future__ import annotations
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from types import FrameType
+from typing import Optional
+
+from .metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+
+def describe_handle(handle: asyncio.Handle) -> str:
+    callback = handle._callback  # type: ignore
+    task = getattr(callback, '__self__', None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return f'{task.get_name()} {getattr(coro, "__qualname__", coro)!r}'
+    return repr(handle)
+
+
+def format_frames(frame: Optional[FrameType]) -> list[str]:
+    return traceback.format_list(traceback.extract_stack(frame)) if frame is not None else []
+
+
+class LoopLagMonitor:
+    """Measures how late the loop wakes up a task sleeping ``interval`` seconds"""
+
+    def __init__(self, *, interval: float = 0.25, threshold: float = 0.1, histogram: Optional[Histogram] = None):
+        self.interval = interval
+        self.threshold = threshold
+        self.histogram = histogram
+        self.samples: collections.deque[float] = collections.deque(maxlen=240)
+        self.worst = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            self.samples.append(lag)
+            self.worst = max(self.worst, lag)
+            if self.histogram is not None:
+                self.histogram.observe(lag)
+            if lag >= self.threshold:
+                log.warning('Event loop lagged %.3f s', lag)
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+@dataclass
+class SlowCallback:
+    name: str
+    duration: float
+    stack: list[str]
+    at: float
+
+
+class SlowCallbackDetector:
+    """Reports loop callbacks (task steps included) that run longer than ``threshold``.
+
+    ``asyncio.Handle._run`` is wrapped to note which callback is running.
+    A watchdog thread grabs the loop thread's stack once that callback is
+    over the threshold, so the stack shows where it was blocking rather
+    than where it suspended afterwards.
+    """
+
+    def __init__(self, *, threshold: float = 0.1, keep: int = 50):
+        self.threshold = threshold
+        self.slow: collections.deque[SlowCallback] = collections.deque(maxlen=keep)
+        self._running: Optional[tuple[asyncio.Handle, float]] = None
+        self._stack: list[str] = []
+        self._loop_thread: Optional[int] = None
+        self._original_run = None
+        # one per run, an old watchdog still waking up after a restart sees its own one set
+        self._stopped = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self._original_run is not None
+
+    def start(self) -> None:
+        if self.enabled:
+            return
+        self._loop_thread = threading.get_ident()
+        self._original_run = original_run = asyncio.Handle._run
+        detector = self
+
+        def _run(handle: asyncio.Handle) -> None:
+            if threading.get_ident() != detector._loop_thread:
+                return original_run(handle)
+            start = time.perf_counter()
+            detector._running = (handle, start)
+            try:
+                original_run(handle)
+            finally:
+                detector._running = None
+                duration = time.perf_counter() - start
+                if duration >= detector.threshold:
+                    detector.report(handle, duration)
+
+        asyncio.Handle._run = _run  # type: ignore
+        self._stopped = threading.Event()
+        threading.Thread(target=self._watch, args=(self._stopped,), name='slow-callback-watchdog', daemon=True).start()
+
+    def stop(self) -> None:
+        if self._original_run is not None:
+            asyncio.Handle._run = self._original_run  # type: ignore
+            self._original_run = None
+            self._stopped.set()
+
+    def _watch(self, stopped: threading.Event) -> None:
+        seen = None
+        while not stopped.wait(self.threshold / 2):
+            running = self._running
+            if running is None or running is seen:
+                continue
+            if time.perf_counter() - running[1] >= self.threshold:
+                seen = running
+                self._stack = format_frames(sys._current_frames().get(self._loop_thread))  # type: ignore
+
+    def report(self, handle: asyncio.Handle, duration: float) -> None:
+        stack, self._stack = self._stack, []
+        if not stack:
+            # finished before the watchdog looked, the task's own frames are the next best thing
+            task = getattr(handle._callback, '__self__', None)  # type: ignore
+            if isinstance(task, asyncio.Task):
+                stack = traceback.format_list([
+                    summary for frame in task.get_stack() for summary in traceback.extract_stack(frame, limit=1)
+                ])
+        name = describe_handle(handle)
+        self.slow.append(SlowCallback(name, duration, stack, time.time()))
+        log.warning('Slow callback %s took %.3f s', name, duration)
+
+
+class SamplingProfiler:
+    """Samples the loop thread's stack from another thread.
+
+    The result is in the collapsed stack format (``frame;frame;frame count``),
+    which flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, *, interval: float = 0.005):
+        self.interval = interval
+        self.running = False
+
+    @staticmethod
+    def _collapse(frame: Optional[FrameType]) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({code.co_filename}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _sample(self, thread_id: int, duration: float) -> collections.Counter[str]:
+        stacks: collections.Counter[str] = collections.Counter()
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            frame = sys._current_frames().get(thread_id)  # type: ignore
+            if frame is not None:
+                stacks[self._collapse(frame)] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    async def profile(self, duration: float) -> collections.Counter[str]:
+        if self.running:
+            raise RuntimeError('A profile is already running')
+        self.running = True
+        try:
+            return await asyncio.to_thread(self._sample, threading.get_ident(), duration)
+        finally:
+            self.running = False
+
+    @staticmethod
+    def dump(stacks: collections.Counter[str]) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
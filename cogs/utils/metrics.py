@@ -0,0 +1,202 @@
+from __future__ import annotations
+import bisect
+import contextlib
+import logging
+import math
+import re
+import time
+from typing import Callable, Iterator, Optional
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+# seconds, from a cache hit to a slow playlist page
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self._values: dict[tuple, float] = {}
+
+    def _key(self, labels: dict[str, object]) -> tuple:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f'{self.name}{_labels(self.label_names, key)} {_number(value)}'
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type}'
+        yield from self.samples()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels: object) -> None:
+        # for totals kept elsewhere, copied in by a collector
+        self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels: object) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), *, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per bucket counts, the last one is +Inf, sum)
+        self._histograms: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        if (histogram := self._histograms.get(key)) is None:
+            histogram = self._histograms[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = histogram
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def clear(self) -> None:
+        self._histograms.clear()
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, total) in self._histograms.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                labels = _labels(self.label_names, key, f'le="{_number(bound)}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _labels(self.label_names, key)
+            yield f'{self.name}_sum{labels} {_number(total[0])}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Metrics:
+    """Registry of the bot's metrics, rendered in the Prometheus text format.
+
+    Metrics are created on first use and shared afterwards, so reloading a
+    cog keeps its counters. ``collectors`` run right before every render,
+    for gauges that are cheaper to read on scrape than to keep up to date.
+    """
+
+    def __init__(self, *, prefix: str = 'boopfm'):
+        self.prefix = prefix
+        self.collectors: list[Callable[[], None]] = []
+        self._metrics: dict[str, Metric] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    def _get(self, cls: type[Metric], name: str, documentation: str, labels: tuple[str, ...], **kwargs) -> Metric:
+        name = f'{self.prefix}_{name}'
+        if (metric := self._metrics.get(name)) is None:
+            metric = self._metrics[name] = cls(name, documentation, labels, **kwargs)
+        elif type(metric) is not cls or metric.label_names != labels:
+            raise ValueError(f'metric {name} is already registered as a {metric.type} with labels {metric.label_names}')
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._get(Counter, name, documentation, labels)  # type: ignore
+
+    def gauge(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self._get(Gauge, name, documentation, labels)  # type: ignore
+
+    def histogram(
+        self, name: str, documentation: str, labels: tuple[str, ...] = (), *, buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._get(Histogram, name, documentation, labels, buckets=buckets)  # type: ignore
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception:
+                log.exception('Metrics collector %r failed', collector)
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+    async def start(self, host: str = '127.0.0.1', port: int = 9100) -> None:
+        """Serve ``/metrics`` over http"""
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        log.info('Serving metrics on http://%s:%s/metrics', host, port)
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class RateLimitHandler(logging.Handler):
+    """Counts discord.py's 429 retries and the time spent sleeping on them.
+
+    The http client only reports these through its log records, the retry
+    delay is the last argument of the message.
+    """
+
+    PATTERN = re.compile(r'rate limit.*Retrying in', re.IGNORECASE)
+
+    def __init__(self, metrics: Metrics):
+        super().__init__(logging.WARNING)
+        self.hits = metrics.counter('ratelimit_hits_total', 'REST responses with status 429', ('source',))
+        self.waits = metrics.counter('ratelimit_wait_seconds_total', 'Time spent waiting on rate limits', ('source',))
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if not self.PATTERN.search(str(record.msg)) or not record.args:
+            return
+        source = 'discord_global' if 'Global' in str(record.msg) else 'discord'
+        self.hits.inc(source=source)
+        if source == 'discord':
+            # a global limit is logged twice for the same sleep
+            self.waits.inc(float(record.args[-1]), source=source)  # type: ignore
@@ -0,0 +1,198 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Any, Optional
+
+import wavelink
+from wavelink.utils import MISSING
+
+if TYPE_CHECKING:
+    from discord import Client
+    from wavelink.ext import spotify
+
+log = logging.getLogger(__name__)
+
+DEFAULT_NODE = {
+    'identifier': 'main',
+    'host': '127.0.0.1',
+    'port': 2333,
+    'password': 'youshallnotpass',
+}
+
+# node identifier -> voice regions (``VoiceChannel.rtc_region``) it prefers
+node_regions: dict[str, set[str]] = {}
+
+
+def load_node_configs() -> list[dict[str, Any]]:
+    """Read Lavalink nodes from ``LAVALINK_NODES`` or the ``LAVALINK_NODES_FILE`` json file.
+
+    ``LAVALINK_NODES`` is either a json list or ``host:port[,host:port...]``,
+    every node entry takes ``identifier``, ``host``, ``port``, ``password``,
+    ``https`` and an optional ``regions`` list.
+    """
+    raw = os.environ.get('LAVALINK_NODES')
+    if raw is None:
+        path = os.environ.get('LAVALINK_NODES_FILE', 'nodes.json')
+        if not os.path.exists(path):
+            return [DEFAULT_NODE]
+        with open(path, encoding='utf-8') as f:
+            raw = f.read()
+
+    raw = raw.strip()
+    if raw.startswith('['):
+        configs = json.loads(raw)
+    else:
+        configs = []
+        for address in raw.split(','):
+            host, _, port = address.strip().rpartition(':')
+            configs.append({'host': host, 'port': int(port)})
+
+    return [
+        {
+            **DEFAULT_NODE,
+            'identifier': f'{config["host"]}:{config.get("port", DEFAULT_NODE["port"])}',
+            **config,
+        }
+        for config in configs
+    ]
+
+
+async def connect_nodes(
+    bot: Client,
+    configs: list[dict[str, Any]],
+    *,
+    spotify_client: Optional[spotify.SpotifyClient] = None,
+) -> list[wavelink.Node]:
+    async def connect(config: dict[str, Any]) -> wavelink.Node:
+        config = dict(config)
+        node_regions[config['identifier']] = set(config.pop('regions', ()))
+        return await wavelink.NodePool.create_node(bot=bot, spotify_client=spotify_client, **config)
+
+    return await asyncio.gather(*map(connect, configs))
+
+
+def node_load(node: wavelink.Node) -> float:
+    """Lavalink's load penalty (players, cpu, nulled and deficit frames)
+
+    Stats only arrive once a minute, players placed since then are added
+    on top so a burst of connects doesn't land on the same node.
+    """
+    if node.stats is None:
+        return len(node.players)
+    return node.penalty + max(0, len(node.players) - node.stats.players)
+
+
+def best_node(region: Optional[str] = None) -> wavelink.Node:
+    nodes = [node for node in wavelink.NodePool._nodes.values() if node.is_connected()]
+    if not nodes:
+        raise wavelink.ZeroConnectedNodes('There are no connected Nodes on this pool.')
+
+    if region is not None:
+        nodes = [node for node in nodes if region in node_regions.get(node.identifier, ())] or nodes
+    return min(nodes, key=node_load)
+
+
+async def move_player(player: wavelink.Player, node: wavelink.Node) -> None:
+    """Move ``player`` to ``node`` keeping its track, position, volume and pause state"""
+    position = player.position
+    paused = player.is_paused()
+    source = player.source
+
+    with contextlib.suppress(ValueError):
+        player.node._players.remove(player)
+    player.node = node
+    node._players.append(player)
+
+    # the new node has to join the voice session before it can play anything
+    await player._dispatch_voice_update(player._voice_state)
+    if source is not None:
+        await player.play(source, start=int(position * 1000))
+    if player.volume != 100:
+        await player.set_volume(player.volume)
+    if paused:
+        await player.set_pause(True)
+
+
+class NodeMonitor:
+    """Moves players off nodes that lost their websocket.
+
+    Once a failed node reconnects, the players it still holds from before
+    the failure are destroyed so they don't fight the new node over voice.
+
+    wavelink only retries nodes that were connected once. Nodes whose
+    first connect failed, like when Lavalink starts after the bot, are
+    retried here with a backoff of up to ``max_retry`` seconds.
+    """
+
+    def __init__(self, *, interval: float = 0.5, max_retry: float = 60.0):
+        self.interval = interval
+        self.max_retry = max_retry
+        self.task: Optional[asyncio.Task] = None
+        # node identifier -> guild ids moved away from it
+        self.evicted: dict[str, set[int]] = {}
+        # node identifier -> (delay, monotonic time of the next connect attempt)
+        self.retries: dict[str, tuple[float, float]] = {}
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            for node in list(wavelink.NodePool._nodes.values()):
+                try:
+                    if node.is_connected():
+                        await self.cleanup(node)
+                        continue
+                    if node.players:
+                        await self.failover(node)
+                    await self.reconnect(node)
+                except Exception:
+                    log.exception('Node health check failed for %s', node.identifier)
+
+    async def failover(self, node: wavelink.Node) -> None:
+        evicted = self.evicted.setdefault(node.identifier, set())
+        for player in list(node.players):
+            try:
+                target = best_node(getattr(player.channel, 'rtc_region', None))
+            except wavelink.ZeroConnectedNodes:
+                return
+            await move_player(player, target)
+            evicted.add(player.guild.id)
+            log.warning('Moved player %s from node %s to %s', player.guild.id, node.identifier, target.identifier)
+
+    async def reconnect(self, node: wavelink.Node) -> None:
+        websocket = node._websocket
+        if websocket is MISSING or websocket.listener is not None:
+            # the listener reconnects by itself
+            return
+        now = time.monotonic()
+        delay, at = self.retries.get(node.identifier, (0.0, now))
+        if now < at:
+            return
+        await websocket.connect()
+        if node.is_connected():
+            self.retries.pop(node.identifier, None)
+            log.info('Connected to node %s', node.identifier)
+        else:
+            delay = min(max(delay * 2, 1.0), self.max_retry)
+            self.retries[node.identifier] = (delay, now + delay)
+
+    async def cleanup(self, node: wavelink.Node) -> None:
+        guild_ids = self.evicted.pop(node.identifier, None)
+        if not guild_ids:
+            return
+        for guild_id in guild_ids:
+            # the guild could have been placed back here since then
+            if not any(player.guild.id == guild_id for player in node.players):
+                await node._websocket.send(op='destroy', guildId=str(guild_id))
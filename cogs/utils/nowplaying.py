@@ -0,0 +1,80 @@
+from __future__ import annotations
+import asyncio
+import time
+from typing import TYPE_CHECKING, Optional
+
+import discord
+
+if TYPE_CHECKING:
+    from discord.abc import Messageable
+
+
+class ChannelBuckets:
+    """Spaces out our own message sends/edits per channel"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.waited = 0.0
+        self._next: dict[int, float] = {}
+
+    async def acquire(self, channel_id: int) -> None:
+        now = time.monotonic()
+        at = self._next.get(channel_id, now)
+        self._next[channel_id] = max(at, now) + self.interval
+        if at > now:
+            self.waited += at - now
+            await asyncio.sleep(at - now)
+
+
+class NowPlaying:
+    """Keeps a single now-playing message up to date by editing it in place.
+
+    Updates are applied ``delay`` seconds after the first one of a burst,
+    only the latest state gets sent. ``None`` deletes the message.
+    """
+
+    def __init__(self, channel: Messageable, *, buckets: ChannelBuckets, delay: float = 1.0):
+        self.channel = channel
+        self.buckets = buckets
+        self.delay = delay
+        self.message: Optional[discord.Message] = None
+        self._embed: Optional[discord.Embed] = None
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, embed: Optional[discord.Embed]) -> None:
+        self._embed = embed
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        await asyncio.sleep(self.delay)
+        while self._dirty:
+            await self.buckets.acquire(self.channel.id)  # type: ignore
+            self._dirty = False
+            await self._apply(self._embed)
+
+    async def _apply(self, embed: Optional[discord.Embed]) -> None:
+        if embed is None:
+            if self.message is not None:
+                message, self.message = self.message, None
+                try:
+                    await message.delete()
+                except discord.NotFound:
+                    pass
+            return
+
+        if self.message is not None:
+            try:
+                await self.message.edit(embed=embed)
+                return
+            except discord.NotFound:
+                pass
+        self.message = await self.channel.send(embed=embed)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        self._dirty = False
+        await self._apply(None)
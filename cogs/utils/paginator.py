@@ -1,6 +1,7 @@
 from __future__ import annotations
 import asyncio
-from typing import TYPE_CHECKING, Dict, Optional, Any
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional, Any, Hashable
 
 import discord
 from discord.ext import menus
@@ -9,6 +10,8 @@ if TYPE_CHECKING:
     from bot import Bot
 
 class PaginatorView(discord.ui.View):
+    PAGE_CACHE_SIZE = 8
+
     def __init__(
         self,
         source: menus.PageSource,
@@ -26,6 +29,8 @@ class PaginatorView(discord.ui.View):
         self.current_page: int = 0
         self.compact: bool = compact
         self.input_lock = asyncio.Lock()
+        # (page, source version) -> rendered kwargs
+        self._page_cache: OrderedDict[tuple[int, Hashable], Dict[str, Any]] = OrderedDict()
         self.clear_items()
         self.fill_items()
 
@@ -60,10 +65,27 @@ class PaginatorView(discord.ui.View):
         else:
             return {}
 
+    async def _render_page(self, page_number: int) -> Dict[str, Any]:
+        version = getattr(self.source, 'version', None)
+        if version is None:
+            page = await self.source.get_page(page_number)
+            return await self._get_kwargs_from_page(page)
+
+        key = (page_number, version)
+        try:
+            kwargs = self._page_cache[key]
+        except KeyError:
+            page = await self.source.get_page(page_number)
+            kwargs = self._page_cache[key] = await self._get_kwargs_from_page(page)
+            if len(self._page_cache) > self.PAGE_CACHE_SIZE:
+                self._page_cache.popitem(last=False)
+        else:
+            self._page_cache.move_to_end(key)
+        return kwargs
+
     async def show_page(self, interaction: discord.Interaction, page_number: int) -> None:
-        page = await self.source.get_page(page_number)
         self.current_page = page_number
-        kwargs = await self._get_kwargs_from_page(page)
+        kwargs = await self._render_page(page_number)
         self._update_labels(page_number)
         if kwargs:
             if interaction.response.is_done():
@@ -110,7 +132,7 @@ class PaginatorView(discord.ui.View):
             pass
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        if interaction.user and interaction.user_id in (self.interaction.bot.owner_id, self.interaction.author_id):
+        if interaction.user and interaction.user.id in (self.interaction.client.owner_id, self.interaction.user.id):
             return True
         await interaction.response.send_message('This pagination menu cannot be controlled by you, sorry!', ephemeral=True)
         return False
@@ -128,8 +150,7 @@ class PaginatorView(discord.ui.View):
             return
 
         await self.source._prepare_once()
-        page = await self.source.get_page(self.current_page)
-        kwargs = await self._get_kwargs_from_page(page)
+        kwargs = await self._render_page(self.current_page)
         self._update_labels(self.current_page)
         await self.interaction.response.send_message(**kwargs, view=self)
         self.message = await self.interaction.original_message()
@@ -197,6 +218,14 @@ class PaginatorView(discord.ui.View):
 class BaseListSource(menus.ListPageSource):
     BASE_COLOR = 0x0084c7
 
+    @property
+    def version(self) -> Optional[Hashable]:
+        """Changes whenever a rendered page could change, used as a cache key by PaginatorView.
+
+        ``None``, the default, renders every page again each time it is shown.
+        """
+        return None
+
     def base_embed(self, view: PaginatorView, entries) -> discord.Embed:
         e = discord.Embed(
             color=0x0084c7
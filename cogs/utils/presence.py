@@ -0,0 +1,74 @@
+from __future__ import annotations
+import asyncio
+import collections
+import logging
+from typing import TYPE_CHECKING, Optional
+
+import discord
+
+if TYPE_CHECKING:
+    from discord import Client
+
+log = logging.getLogger(__name__)
+
+
+class PresenceScheduler:
+    """Updates the bot's activity from all players at most once per ``interval``.
+
+    Policies:
+    ``top`` shows the track playing in the most guilds,
+    ``count`` shows the number of guilds something is playing in.
+    Both show the track itself when only one guild is playing.
+    """
+
+    def __init__(self, bot: Client, *, policy: str = 'top', interval: float = 15.0):
+        self.bot = bot
+        self.policy = policy
+        self.interval = interval
+        self.current: Optional[tuple[discord.ActivityType, str]] = None
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def mark(self) -> None:
+        self._dirty.set()
+
+    def activity(self) -> Optional[discord.Activity]:
+        titles = [
+            vc.source.title  # type: ignore
+            for vc in self.bot.voice_clients
+            if getattr(vc, 'source', None) is not None
+        ]
+        if not titles:
+            return None
+
+        if len(titles) > 1:
+            if self.policy == 'count':
+                return discord.Activity(name=f'музыку на {len(titles)} серверах', type=discord.ActivityType.playing)
+            title, _ = collections.Counter(titles).most_common(1)[0]
+        else:
+            title = titles[0]
+        return discord.Activity(name=title, type=discord.ActivityType.listening)
+
+    async def run(self) -> None:
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+
+            try:
+                activity = self.activity()
+                key = activity and (activity.type, activity.name)
+                if key != self.current:
+                    await self.bot.change_presence(activity=activity)
+                    self.current = key
+            except Exception:
+                log.exception('Could not update the presence')
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,522 @@
+from __future__ import annotations
+import asyncio
+import bisect
+import collections
+import itertools
+import random
+import re
+from typing import Callable, Generic, Iterable, Iterator, Optional, TypeVar, Union, overload
+
+from wavelink import QueueEmpty
+
+T = TypeVar('T')
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> list[str]:
+    return _WORD.findall(text.casefold())
+
+
+class _Node(Generic[T]):
+    __slots__ = ('value', 'priority', 'size', 'length', 'total', 'left', 'right', 'parent')
+
+    def __init__(self, value: T, length: float):
+        self.value = value
+        self.priority = random.random()
+        self.size = 1
+        self.length = length
+        self.total = length
+        self.left: Optional[_Node[T]] = None
+        self.right: Optional[_Node[T]] = None
+        self.parent: Optional[_Node[T]] = None
+
+    def detach(self) -> _Node[T]:
+        self.left = self.right = self.parent = None
+        self.size = 1
+        self.total = self.length
+        return self
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node is not None else 0
+
+
+def _total(node: Optional[_Node]) -> float:
+    return node.total if node is not None else 0
+
+
+def _pull(node: _Node[T]) -> _Node[T]:
+    node.size = 1 + _size(node.left) + _size(node.right)
+    node.total = node.length + _total(node.left) + _total(node.right)
+    if node.left is not None:
+        node.left.parent = node
+    if node.right is not None:
+        node.right.parent = node
+    return node
+
+
+def _split(node: Optional[_Node[T]], k: int) -> tuple[Optional[_Node[T]], Optional[_Node[T]]]:
+    """Split off the first ``k`` items"""
+    if node is None:
+        return None, None
+    if _size(node.left) >= k:
+        left, node.left = _split(node.left, k)
+        return left, _pull(node)
+    node.right, right = _split(node.right, k - _size(node.left) - 1)
+    return _pull(node), right
+
+
+def _merge(a: Optional[_Node[T]], b: Optional[_Node[T]]) -> Optional[_Node[T]]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        a.right = _merge(a.right, b)
+        return _pull(a)
+    b.left = _merge(a, b.left)
+    return _pull(b)
+
+
+def _build(nodes: Iterable[_Node[T]]) -> Optional[_Node[T]]:
+    """Build a treap out of detached nodes in O(n), the stack holds its right spine"""
+    stack: list[_Node[T]] = []
+    for node in nodes:
+        last = None
+        while stack and stack[-1].priority < node.priority:
+            last = _pull(stack.pop())
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+    for node in reversed(stack):
+        _pull(node)
+    return stack[0] if stack else None
+
+
+def _kth(node: Optional[_Node[T]], k: int) -> _Node[T]:
+    while node is not None:
+        left = _size(node.left)
+        if k < left:
+            node = node.left
+        elif k == left:
+            return node
+        else:
+            k -= left + 1
+            node = node.right
+    raise IndexError('queue index out of range')
+
+
+def _prefix(node: Optional[_Node], k: int) -> float:
+    """Summed length of the first ``k`` items"""
+    total = 0.0
+    while node is not None and k > 0:
+        left = _size(node.left)
+        if k <= left:
+            node = node.left
+        else:
+            total += _total(node.left) + node.length
+            k -= left + 1
+            node = node.right
+    return total
+
+
+def _iter_nodes(node: Optional[_Node[T]], k: int = 0) -> Iterator[_Node[T]]:
+    stack: list[_Node[T]] = []
+    while node is not None:
+        left = _size(node.left)
+        if k <= left:
+            stack.append(node)
+            node = node.left
+        else:
+            k -= left + 1
+            node = node.right
+    while stack:
+        node = stack.pop()
+        yield node
+        node = node.right
+        while node is not None:
+            stack.append(node)
+            node = node.left
+
+
+def _iter_from(node: Optional[_Node[T]], k: int = 0) -> Iterator[T]:
+    return (node.value for node in _iter_nodes(node, k))
+
+
+class _TokenIndex(Generic[T]):
+    """Token -> the nodes whose item has it, plus the sorted distinct tokens for prefix matches"""
+
+    def __init__(self, tokens: Callable[[T], Iterable[str]]):
+        self.tokens = tokens
+        self.postings: dict[str, set[_Node[T]]] = {}
+        self.sorted: list[str] = []
+
+    def add(self, node: _Node[T]) -> None:
+        for token in set(self.tokens(node.value)):
+            if (nodes := self.postings.get(token)) is None:
+                nodes = self.postings[token] = set()
+                bisect.insort(self.sorted, token)
+            nodes.add(node)
+
+    def remove(self, node: _Node[T]) -> None:
+        for token in set(self.tokens(node.value)):
+            nodes = self.postings.get(token)
+            if nodes is None:
+                continue
+            nodes.discard(node)
+            if not nodes:
+                del self.postings[token]
+                del self.sorted[bisect.bisect_left(self.sorted, token)]
+
+    def clear(self) -> None:
+        self.postings.clear()
+        self.sorted.clear()
+
+    def _prefixed(self, prefix: str) -> set[_Node[T]]:
+        start = bisect.bisect_left(self.sorted, prefix)
+        end = bisect.bisect_left(self.sorted, prefix + '\U0010ffff', start)
+        if end - start == 1:
+            return self.postings[self.sorted[start]]
+        return set().union(*(self.postings[token] for token in self.sorted[start:end]))
+
+    def match(self, words: list[str]) -> set[_Node[T]]:
+        """Nodes having, for every word, a token starting with it"""
+        if not words:
+            return set()
+        # whole words first, they usually match the fewest tokens
+        candidates = sorted((self._prefixed(word) for word in set(words)), key=len)
+        found = set(candidates[0])
+        for nodes in candidates[1:]:
+            found &= nodes
+            if not found:
+                break
+        return found
+
+
+class TrackQueue(Generic[T]):
+    """Player queue with cheap positional operations.
+
+    Items live in an implicit treap, so indexing, insert, remove, move and
+    jump are O(log n). Dequeued items are taken from a small front buffer
+    that is refilled ``CHUNK`` items at a time, which keeps ``get`` O(1)
+    amortized. Dequeued items are kept in the bounded ``history``.
+
+    Tree nodes also carry the summed ``length`` of their subtree, so the
+    total duration and the time until any position are O(log n) as well.
+
+    With ``tokens``, the queue keeps a token index of its items for
+    ``search``. Nodes know their parent, so a match's position is O(log n).
+    """
+
+    CHUNK = 64
+
+    def __init__(
+        self,
+        *,
+        history: int = 50,
+        length: Callable[[T], float] = lambda t: getattr(t, 'length', 0) or 0,
+        tokens: Optional[Callable[[T], Iterable[str]]] = None,
+    ):
+        self.length = length
+        self._head: collections.deque[_Node[T]] = collections.deque()
+        self._head_total = 0.0
+        self._root: Optional[_Node[T]] = None
+        self._index: Optional[_TokenIndex[T]] = _TokenIndex(tokens) if tokens is not None else None
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+        # bumped on every mutation, lets readers cache anything derived from the queue
+        self.version = 0
+        # called as listener(op, *args) for every mutation, used for journaling
+        self.listener: Optional[Callable[..., None]] = None
+        self.history: collections.deque[T] = collections.deque(maxlen=history)
+
+    def __repr__(self) -> str:
+        return f'<TrackQueue count={len(self)} history={len(self.history)}>'
+
+    def __len__(self) -> int:
+        return len(self._head) + _size(self._root)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator[T]:
+        return itertools.chain((node.value for node in self._head), _iter_from(self._root))
+
+    @property
+    def count(self) -> int:
+        return len(self)
+
+    @property
+    def is_empty(self) -> bool:
+        return not len(self)
+
+    @property
+    def duration(self) -> float:
+        """Summed length of every queued item"""
+        return self._head_total + _total(self._root)
+
+    def eta(self, index: int) -> float:
+        """Summed length of the items before ``index``"""
+        index = min(max(index, 0), len(self))
+        head = len(self._head)
+        if index <= head:
+            return sum(node.length for node in itertools.islice(self._head, index))
+        return self._head_total + _prefix(self._root, index - head)
+
+    def _index_of(self, index: int, *, insert: bool = False) -> int:
+        length = len(self) + insert
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('queue index out of range')
+        return index
+
+    def _set_root(self, root: Optional[_Node[T]]) -> None:
+        if root is not None:
+            root.parent = None
+        self._root = root
+
+    def _new(self, item: T) -> _Node[T]:
+        node = _Node(item, self.length(item))
+        if self._index is not None:
+            self._index.add(node)
+        return node
+
+    def _drop(self, nodes: Iterable[_Node[T]]) -> None:
+        if self._index is not None:
+            for node in nodes:
+                self._index.remove(node)
+
+    def _rank(self, node: _Node[T]) -> int:
+        if node.parent is None and node is not self._root:
+            for i, queued in enumerate(self._head):
+                if queued is node:
+                    return i
+            raise ValueError('node is not queued')
+        rank = _size(node.left)
+        while node.parent is not None:
+            if node is node.parent.right:
+                rank += _size(node.parent.left) + 1
+            node = node.parent
+        return len(self._head) + rank
+
+    @overload
+    def __getitem__(self, index: int) -> T:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[T]:
+        ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[T, list[T]]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            return self.slice(start, stop)
+
+        index = self._index_of(index)
+        if index < len(self._head):
+            return self._head[index].value
+        return _kth(self._root, index - len(self._head)).value
+
+    def __setitem__(self, index: int, value: T) -> None:
+        index = self._index_of(index)
+        self._changed('set', index, value)
+        head = len(self._head)
+        node = self._head[index] if index < head else _kth(self._root, index - head)
+        self._drop((node,))
+        node.value = value
+        if index < head:
+            self._head_total -= node.length
+            node.length = node.total = self.length(value)
+            self._head_total += node.length
+        else:
+            node.length = self.length(value)
+            parent: Optional[_Node[T]] = node
+            while parent is not None:
+                _pull(parent)
+                parent = parent.parent
+        if self._index is not None:
+            self._index.add(node)
+
+    def slice(self, start: int, stop: int) -> list[T]:
+        """Items in ``[start, stop)`` in O(log n + stop - start)"""
+        start = max(start, 0)
+        if stop <= start:
+            return []
+        head = len(self._head)
+        items = [node.value for node in itertools.islice(self._head, start, stop)]
+        if stop > head:
+            tree = _iter_from(self._root, max(start - head, 0))
+            items.extend(itertools.islice(tree, stop - max(start, head)))
+        return items
+
+    def search(self, text: str, *, limit: Optional[int] = None) -> list[tuple[int, T]]:
+        """``(index, item)`` of the items whose tokens start with every word of ``text``, in queue order"""
+        if self._index is None:
+            raise TypeError('this queue keeps no token index')
+        matches = sorted((self._rank(node), node.value) for node in self._index.match(tokenize(text)))  # type: ignore
+        return matches[:limit] if limit is not None else matches
+
+    def _refill(self) -> None:
+        if not self._head and self._root is not None:
+            chunk, root = _split(self._root, self.CHUNK)
+            self._set_root(root)
+            self._head_total = _total(chunk)
+            self._head.extend([node.detach() for node in list(_iter_nodes(chunk))])
+
+    def _spill(self) -> None:
+        # keeps the buffer short so that positional operations on it stay O(1)
+        if len(self._head) > 2 * self.CHUNK:
+            spilled = [self._head.pop() for _ in range(len(self._head) - self.CHUNK)]
+            spilled.reverse()
+            spilled_root = _build(spilled)
+            self._head_total -= _total(spilled_root)
+            self._set_root(_merge(spilled_root, self._root))
+
+    def _changed(self, op: str, *args) -> None:
+        self.version += 1
+        if self.listener is not None:
+            self.listener(op, *args)
+
+    def _wakeup_next(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def put(self, item: T) -> None:
+        self._changed('put', item)
+        node = self._new(item)
+        if self._root is None:
+            self._head.append(node)
+            self._head_total += node.length
+            self._spill()
+        else:
+            self._set_root(_merge(self._root, node))
+        self._wakeup_next()
+
+    def extend(self, items: Iterable[T]) -> None:
+        items = list(items)
+        if not items:
+            return
+        self._changed('extend', items)
+        nodes = [self._new(item) for item in items]
+        if self._root is None and len(self._head) + len(nodes) <= 2 * self.CHUNK:
+            self._head.extend(nodes)
+            self._head_total += sum(node.length for node in nodes)
+        else:
+            self._set_root(_merge(self._root, _build(nodes)))
+        self._wakeup_next()
+
+    def insert(self, index: int, item: T) -> None:
+        index = self._index_of(index, insert=True)
+        self._changed('insert', index, item)
+        node = self._new(item)
+        head = len(self._head)
+        if index <= head:
+            self._head.insert(index, node)
+            self._head_total += node.length
+            self._spill()
+        else:
+            left, right = _split(self._root, index - head)
+            self._set_root(_merge(_merge(left, node), right))
+        self._wakeup_next()
+
+    put_at_index = insert
+
+    def insort(self, item: T, *, key: Callable[[T], float]) -> int:
+        """Insert ``item`` after every item with a key not above its own, in a queue ordered by ``key``"""
+        value = key(item)
+        head = len(self._head)
+        if head and key(self._head[-1].value) > value:
+            index = bisect.bisect_right([key(node.value) for node in self._head], value)
+        else:
+            index, node = head, self._root
+            while node is not None:
+                if key(node.value) <= value:
+                    index += _size(node.left) + 1
+                    node = node.right
+                else:
+                    node = node.left
+        self.insert(index, item)
+        return index
+
+    def get(self) -> T:
+        if not len(self):
+            raise QueueEmpty('No items in the queue.')
+        self._changed('get')
+        self._refill()
+        node = self._head.popleft()
+        self._head_total -= node.length
+        self._drop((node,))
+        self.history.append(node.value)
+        return node.value
+
+    async def get_wait(self) -> T:
+        while not len(self):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except:  # noqa
+                waiter.cancel()
+                if len(self) and not waiter.cancelled():
+                    self._wakeup_next()
+                raise
+        return self.get()
+
+    def remove(self, index: int) -> T:
+        index = self._index_of(index)
+        self._changed('remove', index)
+        head = len(self._head)
+        if index < head:
+            node = self._head[index]
+            del self._head[index]
+            self._head_total -= node.length
+        else:
+            left, right = _split(self._root, index - head)
+            node, right = _split(right, 1)  # type: ignore
+            self._set_root(_merge(left, right))
+        self._drop((node,))
+        return node.value
+
+    def move(self, index: int, to: int) -> None:
+        self.insert(to, self.remove(index))
+
+    def jump(self, index: int) -> None:
+        """Drop every item before ``index``"""
+        index = self._index_of(index)
+        self._changed('jump', index)
+        head = len(self._head)
+        if index <= head:
+            dropped = [self._head.popleft() for _ in range(index)]
+            self._head_total -= sum(node.length for node in dropped)
+        else:
+            dropped = list(self._head)
+            self._head.clear()
+            self._head_total = 0.0
+            left, root = _split(self._root, index - head)
+            self._set_root(root)
+            if self._index is not None:
+                dropped.extend(_iter_nodes(left))
+        self._drop(dropped)
+
+    def shuffle(self) -> None:
+        nodes = [*self._head, *_iter_nodes(self._root)]
+        random.shuffle(nodes)
+        self._changed('replace', [node.value for node in nodes])
+        self._head.clear()
+        self._head_total = 0.0
+        self._set_root(_build([node.detach() for node in nodes]))
+
+    def clear(self) -> None:
+        self._changed('clear')
+        self._head.clear()
+        self._head_total = 0.0
+        self._root = None
+        if self._index is not None:
+            self._index.clear()
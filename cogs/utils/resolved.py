@@ -0,0 +1,125 @@
+from __future__ import annotations
+import asyncio
+import json
+import sqlite3
+import time
+from typing import Any, Callable, Optional
+
+SCHEMA = '''
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS resolved (
+    source_id TEXT PRIMARY KEY,
+    track TEXT NOT NULL,
+    resolved_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS resolved_used_at ON resolved (used_at);
+'''
+
+# sqlite allows 999 bound parameters per statement before 3.32
+SELECT_CHUNK = 500
+
+
+class ResolvedStore:
+    """Persists which playable track a source track (a Spotify id) was resolved to.
+
+    Lookups run in a thread, new entries and hits are buffered and written
+    by ``flush``. ``evict`` drops entries resolved more than ``max_age``
+    seconds ago, their video may be gone by now, and the least recently
+    used ones above ``maxsize``.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        encode: Callable[[Any], Any],
+        decode: Callable[[Any], Any],
+        max_age: float = 30 * 86400,
+        maxsize: int = 1_000_000,
+    ):
+        self.encode = encode
+        self.decode = decode
+        self.max_age = max_age
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._pending: dict[str, str] = {}
+        # source id -> hits since the last flush
+        self._used: dict[str, int] = {}
+        self._lock = asyncio.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        (self.size,) = self._db.execute('SELECT COUNT(*) FROM resolved').fetchone()
+
+    def _select(self, ids: list[str]) -> dict[str, str]:
+        found = {}
+        for i in range(0, len(ids), SELECT_CHUNK):
+            chunk = ids[i:i + SELECT_CHUNK]
+            query = f'SELECT source_id, track FROM resolved WHERE source_id IN ({",".join("?" * len(chunk))})'
+            found.update(self._db.execute(query, chunk))
+        return found
+
+    async def get_many(self, ids: list[str]) -> dict[str, Any]:
+        found = {source_id: self._pending[source_id] for source_id in ids if source_id in self._pending}
+        missing = [source_id for source_id in ids if source_id not in found]
+        if missing:
+            async with self._lock:
+                found.update(await asyncio.to_thread(self._select, missing))
+        for source_id in found:
+            self._used[source_id] = self._used.get(source_id, 0) + 1
+        self.hits += len(found)
+        self.misses += len(ids) - len(found)
+        return {source_id: self.decode(json.loads(track)) for source_id, track in found.items()}
+
+    async def get(self, source_id: str) -> Optional[Any]:
+        return (await self.get_many([source_id])).get(source_id)
+
+    def put(self, source_id: str, track: Any) -> None:
+        self._pending[source_id] = json.dumps(self.encode(track))
+
+    def _write(self, pending: dict[str, str], used: dict[str, int]) -> None:
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO resolved (source_id, track, resolved_at, used_at) VALUES (?, ?, ?, ?)',
+                [(source_id, track, now, now) for source_id, track in pending.items()],
+            )
+            self._db.executemany(
+                'UPDATE resolved SET hits = hits + ?, used_at = ? WHERE source_id = ?',
+                [(hits, now, source_id) for source_id, hits in used.items()],
+            )
+
+    async def flush(self) -> None:
+        async with self._lock:
+            pending, self._pending = self._pending, {}
+            used, self._used = self._used, {}
+            if not pending and not used:
+                return
+            try:
+                await asyncio.to_thread(self._write, pending, used)
+            except Exception:
+                # kept for the next flush, newer resolves win
+                self._pending = {**pending, **self._pending}
+                for source_id, hits in used.items():
+                    self._used[source_id] = self._used.get(source_id, 0) + hits
+                raise
+
+    def _evict(self) -> int:
+        with self._db:
+            self._db.execute('DELETE FROM resolved WHERE resolved_at < ?', (time.time() - self.max_age,))
+            (size,) = self._db.execute('SELECT COUNT(*) FROM resolved').fetchone()
+            if size > self.maxsize:
+                self._db.execute(
+                    'DELETE FROM resolved WHERE source_id IN (SELECT source_id FROM resolved ORDER BY used_at LIMIT ?)',
+                    (size - self.maxsize,),
+                )
+                size = self.maxsize
+        return size
+
+    async def evict(self) -> None:
+        async with self._lock:
+            self.size = await asyncio.to_thread(self._evict)
+
+    def close(self) -> None:
+        self._db.close()
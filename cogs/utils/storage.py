@@ -0,0 +1,181 @@
+from __future__ import annotations
+import asyncio
+import collections
+import json
+import sqlite3
+from typing import Any, Callable, Optional
+
+SCHEMA = '''
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    args TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    guild_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL
+);
+'''
+
+
+def empty_state() -> dict[str, Any]:
+    return {'voice': None, 'text': None, 'volume': 100, 'current': None, 'position': 0, 'queue': []}
+
+
+def apply(state: dict[str, Any], op: str, args: list) -> None:
+    queue: collections.deque = state['queue']
+    if op == 'put':
+        queue.append(args[0])
+    elif op == 'extend':
+        queue.extend(args[0])
+    elif op == 'insert':
+        queue.insert(args[0], args[1])
+    elif op == 'set':
+        queue[args[0]] = args[1]
+    elif op == 'get':
+        queue.popleft()
+    elif op == 'remove':
+        del queue[args[0]]
+    elif op == 'jump':
+        for _ in range(args[0]):
+            queue.popleft()
+    elif op == 'replace':
+        state['queue'] = collections.deque(args[0])
+    elif op == 'clear':
+        queue.clear()
+    elif op == 'current':
+        state['current'], state['position'] = args
+    elif op == 'position':
+        state['position'] = args[0]
+
+
+class QueueStore:
+    """Persists player queues in SQLite as an append-only journal of queue
+    operations plus a compact snapshot per guild.
+
+    Writes are buffered and applied in order by ``flush``, a snapshot
+    replaces the guild's journal in the same transaction. While flushes
+    fail, a guild's buffered writes are dropped once a snapshot follows
+    them, so the buffer stays about as small as the journals.
+    """
+
+    def __init__(self, path: str, *, encode: Callable[[Any], Any]):
+        self.encode = encode
+        self.journal_sizes: collections.Counter[int] = collections.Counter()
+        self._pending: list[tuple] = []
+        self._lock = asyncio.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def _encode_arg(self, arg: Any) -> Any:
+        if arg is None or isinstance(arg, int):
+            return arg
+        if isinstance(arg, list):
+            return [self.encode(item) for item in arg]
+        return self.encode(arg)
+
+    def record(self, guild_id: int, op: str, *args: Any) -> None:
+        args = [self._encode_arg(arg) for arg in args]
+        self._pending.append(('op', guild_id, op, json.dumps(args)))
+        self.journal_sizes[guild_id] += 1
+
+    def snapshot(self, guild_id: int, state: dict[str, Any]) -> None:
+        """Replace the guild's journal with ``state``, its tracks are encoded by ``flush``"""
+        self._pending.append(('snapshot', guild_id, state))
+        self.journal_sizes[guild_id] = 0
+
+    def _dump_state(self, state: dict[str, Any]) -> str:
+        return json.dumps({
+            **state,
+            'current': self._encode_arg(state['current']),
+            'queue': self._encode_arg(state['queue']),
+        })
+
+    def forget(self, guild_id: int) -> None:
+        self._pending.append(('forget', guild_id))
+        self.journal_sizes.pop(guild_id, None)
+
+    def _write(self, batch: list[tuple]) -> None:
+        with self._db:
+            for kind, guild_id, *data in batch:
+                if kind == 'op':
+                    self._db.execute('INSERT INTO journal (guild_id, op, args) VALUES (?, ?, ?)', (guild_id, *data))
+                    continue
+                self._db.execute('DELETE FROM journal WHERE guild_id = ?', (guild_id,))
+                if kind == 'snapshot':
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO snapshots (guild_id, state) VALUES (?, ?)',
+                        (guild_id, self._dump_state(*data)),
+                    )
+                else:
+                    self._db.execute('DELETE FROM snapshots WHERE guild_id = ?', (guild_id,))
+
+    @staticmethod
+    def _compact(batch: list[tuple]) -> list[tuple]:
+        # a snapshot or forget makes the guild's earlier writes moot
+        replaced = set()
+        compact = []
+        for item in reversed(batch):
+            kind, guild_id, *_ = item
+            if guild_id in replaced:
+                continue
+            if kind != 'op':
+                replaced.add(guild_id)
+            compact.append(item)
+        compact.reverse()
+        return compact
+
+    async def flush(self) -> None:
+        """Write the buffered changes, they stay buffered if that fails"""
+        async with self._lock:
+            batch, self._pending = self._compact(self._pending), []
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                self._pending[:0] = batch
+                raise
+
+    def _load(self, guild_id: Optional[int]) -> dict[int, dict[str, Any]]:
+        if guild_id is None:
+            # parked guilds, snapshotted without a voice channel, stay on disk
+            where = "WHERE guild_id NOT IN (SELECT guild_id FROM snapshots WHERE json_extract(state, '$.voice') IS NULL)"
+            params: tuple = ()
+        else:
+            where, params = 'WHERE guild_id = ?', (guild_id,)
+
+        states = {}
+        for guild_id, state in self._db.execute(f'SELECT guild_id, state FROM snapshots {where}', params):
+            state = json.loads(state)
+            state['queue'] = collections.deque(state['queue'])
+            states[guild_id] = state
+
+        sizes: collections.Counter[int] = collections.Counter()
+        for guild_id, op, args in self._db.execute(f'SELECT guild_id, op, args FROM journal {where} ORDER BY id', params):
+            if guild_id not in states:
+                states[guild_id] = empty_state()
+                states[guild_id]['queue'] = collections.deque()
+            apply(states[guild_id], op, json.loads(args))
+            sizes[guild_id] += 1
+        self.journal_sizes.update(sizes)
+
+        for state in states.values():
+            state['queue'] = list(state['queue'])
+        return states
+
+    async def load(self, guild_id: Optional[int] = None) -> dict[int, dict[str, Any]]:
+        """Stored guild states, with journals replayed onto their snapshots.
+
+        Without ``guild_id`` every guild but the parked ones, with it just
+        that guild, parked or not, buffered writes included.
+        """
+        if guild_id is not None:
+            await self.flush()
+            self.journal_sizes.pop(guild_id, None)
+        return await asyncio.to_thread(self._load, guild_id)
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,120 @@
+from __future__ import annotations
+import bisect
+import heapq
+import time
+from typing import Optional
+
+from .cache import normalize_query
+
+
+class _Entry:
+    __slots__ = ('text', 'value', 'score', 'at', 'keys')
+
+    def __init__(self, text: str, value: str, keys: list[str]):
+        self.text = text
+        self.value = value
+        self.score = 0.0
+        self.at = 0.0
+        self.keys = keys
+
+
+class PrefixIndex:
+    """Autocomplete suggestions for typed prefixes, ranked by popularity.
+
+    Entries can be found by a prefix of their text or of any of its first
+    ``max_words`` words. ``_keys`` is a sorted array with one
+    ``(suffix, entry)`` pair per word start, so a lookup is a bisect
+    followed by a scan of the run that shares the prefix.
+
+    Scores decay with ``half_life`` seconds. Once ``maxsize`` entries are
+    held, the least popular tenth is dropped.
+    """
+
+    def __init__(self, *, maxsize: int = 10_000, half_life: float = 7 * 86400, max_words: int = 8, scan: int = 256):
+        self.maxsize = maxsize
+        self.half_life = half_life
+        self.max_words = max_words
+        self.scan = scan
+        self._entries: dict[str, _Entry] = {}
+        self._keys: list[tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, text: str) -> bool:
+        return normalize_query(text) in self._entries
+
+    def _score(self, entry: _Entry, now: float) -> float:
+        return entry.score * 0.5 ** ((now - entry.at) / self.half_life)
+
+    def _suffixes(self, key: str) -> list[str]:
+        words = key.split(' ')
+        return [' '.join(words[i:]) for i in range(min(len(words), self.max_words))]
+
+    def add(self, text: str, value: Optional[str] = None, *, weight: float = 1.0) -> None:
+        """Count a use of ``text``, ``value`` is what picking it sends (``text`` by default)"""
+        key = normalize_query(text)
+        if not key:
+            return
+        now = time.time()
+        if (entry := self._entries.get(key)) is None:
+            if len(self._entries) >= self.maxsize:
+                self._evict(now)
+            entry = self._entries[key] = _Entry(text, value or text, self._suffixes(key))
+            for suffix in entry.keys:
+                bisect.insort(self._keys, (suffix, key))
+        else:
+            entry.text, entry.value = text, value or text
+        entry.score = self._score(entry, now) + weight
+        entry.at = now
+
+    def remove(self, text: str) -> None:
+        key = normalize_query(text)
+        if (entry := self._entries.pop(key, None)) is None:
+            return
+        for suffix in entry.keys:
+            i = bisect.bisect_left(self._keys, (suffix, key))
+            if i < len(self._keys) and self._keys[i] == (suffix, key):
+                del self._keys[i]
+
+    def _evict(self, now: float) -> None:
+        count = max(1, self.maxsize // 10)
+        for key in heapq.nsmallest(count, self._entries, key=lambda k: self._score(self._entries[k], now)):
+            self.remove(key)
+
+    def lookup(self, prefix: str, *, limit: int = 25) -> list[tuple[str, str]]:
+        """``(text, value)`` pairs matching ``prefix``, most popular first"""
+        now = time.time()
+        prefix = normalize_query(prefix)
+        if not prefix:
+            candidates = self._entries.keys()
+        else:
+            found: dict[str, None] = {}
+            i = bisect.bisect_left(self._keys, (prefix,))
+            end = min(len(self._keys), i + self.scan)
+            while i < end and self._keys[i][0].startswith(prefix):
+                found[self._keys[i][1]] = None
+                i += 1
+            candidates = found.keys()
+
+        best = heapq.nlargest(limit, candidates, key=lambda k: self._score(self._entries[k], now))
+        return [(self._entries[key].text, self._entries[key].value) for key in best]
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` calls per ``per`` seconds"""
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self._tokens = float(rate)
+        self._at = time.monotonic()
+
+    def acquire(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._at) * self.rate / self.per)
+        self._at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
@@ -0,0 +1,129 @@
+from __future__ import annotations
+from typing import Any, Optional
+
+import wavelink
+
+
+class QueuedTrack:
+    """Compact queue entry.
+
+    Holds the encoded Lavalink track, what the queue pages show, the
+    requester's id and its ``turn`` when the queue is fair (see
+    FairScheduler). Partial tracks (Spotify items) only have a search
+    ``query`` and their ``spotify_id`` until they are resolved. The
+    wavelink track object is built by ``build`` right before it plays.
+    """
+
+    __slots__ = ('id', 'query', 'title', 'author', 'uri', 'length', 'requester_id', 'turn', 'spotify_id')
+
+    def __init__(
+        self,
+        *,
+        id: Optional[str] = None,
+        query: Optional[str] = None,
+        title: str,
+        author: Optional[str] = None,
+        uri: Optional[str] = None,
+        length: float = 0.0,
+        requester_id: Optional[int] = None,
+        turn: Optional[float] = None,
+        spotify_id: Optional[str] = None,
+    ):
+        self.id = id
+        self.query = query
+        self.title = title
+        self.author = author
+        self.uri = uri
+        # seconds, like wavelink's Playable.length
+        self.length = length
+        self.requester_id = requester_id
+        self.turn = turn
+        self.spotify_id = spotify_id
+
+    def __str__(self) -> str:
+        return self.title
+
+    def __repr__(self) -> str:
+        return f'<QueuedTrack title={self.title!r} partial={self.is_partial}>'
+
+    @property
+    def is_partial(self) -> bool:
+        return self.id is None
+
+    @classmethod
+    def from_track(cls, track: wavelink.abc.Playable, requester_id: Optional[int] = None) -> QueuedTrack:
+        if isinstance(track, wavelink.PartialTrack):
+            return cls(query=track.query, title=track.title, requester_id=requester_id)
+        return cls(
+            id=track.id,
+            title=track.title,  # type: ignore
+            author=track.author,  # type: ignore
+            uri=track.uri,  # type: ignore
+            length=track.length,
+            requester_id=requester_id,
+        )
+
+    @classmethod
+    def partial(
+        cls,
+        query: str,
+        *,
+        title: Optional[str] = None,
+        author: Optional[str] = None,
+        length: float = 0.0,
+        spotify_id: Optional[str] = None,
+    ) -> QueuedTrack:
+        return cls(query=query, title=title or query, author=author, length=length, spotify_id=spotify_id)
+
+    def copy(self, **changes: Any) -> QueuedTrack:
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return QueuedTrack(**fields)
+
+    def resolved(self, track: QueuedTrack) -> QueuedTrack:
+        """This partial entry, pointing at the ``track`` its query found"""
+        return track.copy(
+            query=self.query, requester_id=self.requester_id, turn=self.turn, spotify_id=self.spotify_id
+        )
+
+    def build(self) -> wavelink.YouTubeTrack:
+        if self.id is None:
+            raise ValueError(f'{self!r} has to be resolved before it can be played')
+        track = wavelink.YouTubeTrack(self.id, {
+            'title': self.title,
+            'author': self.author,
+            'uri': self.uri,
+            'length': int(self.length * 1000),
+            'isStream': False,
+            'isSeekable': True,
+            'position': 0,
+            'identifier': None,
+            'sourceName': 'youtube',
+        })
+        track.requester_id = self.requester_id  # type: ignore
+        return track
+
+    def encode(self) -> dict[str, Any]:
+        data: dict[str, Any] = {'n': self.title}
+        for key, value in (
+            ('t', self.id), ('q', self.query), ('a', self.author),
+            ('u', self.uri), ('l', self.length), ('r', self.requester_id),
+            ('f', self.turn), ('s', self.spotify_id),
+        ):
+            if value:
+                data[key] = value
+        return data
+
+    @classmethod
+    def decode(cls, data: dict[str, Any]) -> QueuedTrack:
+        return cls(
+            id=data.get('t'),
+            query=data.get('q'),
+            title=data.get('n') or data.get('q') or '',
+            author=data.get('a'),
+            uri=data.get('u'),
+            length=data.get('l', 0.0),
+            requester_id=data.get('r'),
+            turn=data.get('f'),
+            spotify_id=data.get('s'),
+        )
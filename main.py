@@ -1,4 +1,21 @@
+import time
+started = time.perf_counter()
+
 import os
-from bot import Bot
 
-Bot().run(token=os.environ.get('TOKEN'))
+from cogs.utils.funcs import getenv
+
+if __name__ == '__main__':
+    if workers := getenv('CLUSTER_WORKERS', 0, int):
+        from cluster import Coordinator
+        Coordinator(
+            os.environ['TOKEN'],
+            workers=workers,
+            shard_count=getenv('SHARD_COUNT', None, int),
+            timeout=getenv('CLUSTER_TIMEOUT', 60.0, float),
+            port=getenv('CLUSTER_PORT', 0, int),
+        ).run()
+    else:
+        from bot import Bot
+        # the root logger, so startup timings and the cogs' logs are printed too
+        Bot(started=started).run(token=os.environ.get('TOKEN'), root_logger=True)